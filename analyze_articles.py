@@ -1,76 +1,224 @@
 import os
-import requests
+import asyncio
+import argparse
 from dotenv import load_dotenv
 from datetime import datetime
-import openai
-import time
+from supabase_rest import get_session, iter_rows, patch_rows
+from llm_cache import LLMCache
+from llm_dispatch import LLMDispatcher, process_rows, LLM_MAX_CONCURRENCY
+from llm_batch import run_batch
+from token_budget import clean_content, count_tokens, truncate_to_tokens, split_into_chunks
+from enrich_articles import (
+    ENRICHMENT_MODEL, ENRICHMENT_FORMAT_INSTRUCTIONS, ENRICHMENT_FIELDS, FusedAnalysis,
+    openai_response_format, parse_enrichment, request_validated
+)
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai.api_key = OPENAI_API_KEY
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+
+ANALYSIS_MODEL = "gpt-3.5-turbo"
+# Bump whenever the prompt or generation settings change so stale summaries aren't reused
+ANALYSIS_PROMPT_VERSION = "2"
+FUSED_PROMPT_VERSION = "fused-3"
+# Article tokens sent in a single analysis call, counted with the model's tokenizer
+ANALYSIS_CONTENT_TOKENS = int(os.getenv("ANALYSIS_CONTENT_TOKENS", "3000"))
+# Longer articles are summarized chunk by chunk first (map) and the chunk
+# summaries analyzed together (reduce), reading at most ANALYSIS_MAX_CHUNKS chunks
+ANALYSIS_MAP_REDUCE_TOKENS = int(os.getenv("ANALYSIS_MAP_REDUCE_TOKENS", "6000"))
+ANALYSIS_MAX_CHUNKS = int(os.getenv("ANALYSIS_MAX_CHUNKS", "8"))
+CHUNK_SUMMARY_MAX_TOKENS = 300
+summary_cache = LLMCache()
 
 def fetch_articles_to_analyze():
-    url = f"{SUPABASE_URL}/rest/v1/articles?scraped=eq.true&summary=is.null&select=id,full_content"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Accept-Profile": "news"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else []
+    return iter_rows("articles", "id,url,full_content", {"scraped": "eq.true", "summary": "is.null", "canonical_article_id": "is.null"})
 
-def analyze_article(content):
+def build_analysis_request(content):
     prompt = (
         "You are an AI assistant helping analyze federal policy and spending news.\n\n"
         "Summarize the article below, then list relevant topics and key named entities (people, agencies, programs, etc).\n\n"
-        f"Article:\n{content[:4000]}"
+        f"Article:\n{content}"
+    )
+    return {
+        "model": ANALYSIS_MODEL,
+        "messages": [
+            {"role": "system", "content": "You are a government news analyst."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.4,
+        "max_tokens": 500
+    }
+
+# One call that produces the summary and the enrichment fields together
+def build_fused_request(content):
+    prompt = (
+        "You are an AI assistant helping analyze federal policy and spending news. Read the article below and "
+        + ENRICHMENT_FORMAT_INSTRUCTIONS
+        + "- summary: a concise summary of the article\n"
+        + ENRICHMENT_FIELDS
+        + f"\nArticle:\n{content}"
     )
+    return {
+        "model": ENRICHMENT_MODEL,
+        "messages": [
+            {"role": "system", "content": "You are a government news analyst."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.4,
+        "max_tokens": 1100,
+        "response_format": openai_response_format(FusedAnalysis)
+    }
+
+def build_chunk_request(chunk, index, total, model):
+    prompt = (
+        f"This is part {index} of {total} of a long article about federal policy and spending. "
+        "Summarize this part in a few sentences, keeping any figures, dates, agencies, companies, people and programs it names.\n\n"
+        f"Part {index}:\n{chunk}"
+    )
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are a government news analyst."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.2,
+        "max_tokens": CHUNK_SUMMARY_MAX_TOKENS
+    }
+
+# Article columns to write for a model response, or None if it is unusable
+def build_article_update(article_id, response, fused=False):
+    if fused:
+        data = parse_enrichment(article_id, response, None, schema_model=FusedAnalysis)
+        if data is not None:
+            data["needs_enrichment"] = False
+        return data
+    return {"summary": response, "last_analysis_at": datetime.utcnow().isoformat()}
+
+# Model and prompt version that cached responses are keyed under
+def cache_identity(fused):
+    return (ENRICHMENT_MODEL, FUSED_PROMPT_VERSION) if fused else (ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION)
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a government news analyst."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.4,
-            max_tokens=500
+# Map step for long articles: summarize the chunks concurrently and return
+# them joined as the text to analyze, or None if any chunk failed
+async def summarize_chunks(article_id, content, model, dispatcher):
+    content = truncate_to_tokens(content, ANALYSIS_CONTENT_TOKENS * ANALYSIS_MAX_CHUNKS, model)
+    # Chunks end on paragraph breaks and are rarely full, so the truncation
+    # alone doesn't bound their number
+    chunks = split_into_chunks(content, ANALYSIS_CONTENT_TOKENS, model)[:ANALYSIS_MAX_CHUNKS]
+    print(f"📚 Article {article_id}: summarizing {len(chunks)} chunks")
+    summaries = await asyncio.gather(*(
+        dispatcher.complete(**build_chunk_request(chunk, i, len(chunks), model))
+        for i, chunk in enumerate(chunks, start=1)
+    ))
+    if not all(summaries):
+        print(f"⚠️ Article {article_id}: chunk summaries incomplete, will retry next run")
+        return None
+    return "Summaries of consecutive parts of the article:\n\n" + "\n\n".join(s.strip() for s in summaries)
+
+async def analyze_article(article, dispatcher, fused=False):
+    content = clean_content(article["full_content"])
+    cached = summary_cache.get(content, *cache_identity(fused))
+    if cached is not None:
+        print("♻️ Reusing cached summary for identical content")
+        return build_article_update(article["id"], cached, fused)
+
+    model = cache_identity(fused)[0]
+    if count_tokens(content, model) > ANALYSIS_MAP_REDUCE_TOKENS:
+        prompt_content = await summarize_chunks(article["id"], content, model, dispatcher)
+        if prompt_content is None:
+            return None
+        prompt_content = truncate_to_tokens(prompt_content, ANALYSIS_CONTENT_TOKENS, model)
+    else:
+        prompt_content = truncate_to_tokens(content, ANALYSIS_CONTENT_TOKENS, model)
+
+    if fused:
+        analysis = await request_validated(
+            article["id"], FusedAnalysis, build_fused_request(prompt_content),
+            lambda request: dispatcher.complete(**request)
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"❌ OpenAI error: {e}")
+        response = analysis.model_dump_json() if analysis else None
+    else:
+        response = await dispatcher.complete(**build_analysis_request(prompt_content))
+    if not response:
         return None
+    data = build_article_update(article["id"], response, fused)
+    if data is not None:
+        summary_cache.put(content, *cache_identity(fused), response)
+    return data
 
-def update_article_analysis(article_id, summary_text):
+def update_article_analysis(article_id, data):
     url = f"{SUPABASE_URL}/rest/v1/articles?id=eq.{article_id}"
     headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
         "Content-Type": "application/json",
         "Prefer": "return=minimal",
         "Content-Profile": "news"
     }
-    data = {
-        "summary": summary_text,
-        "last_analysis_at": datetime.utcnow().isoformat()
-    }
-    response = requests.patch(url, headers=headers, json=data)
+    response = get_session().patch(url, headers=headers, json=data, timeout=30)
     if response.status_code not in [200, 204]:
         print(f"⚠️ Failed to update article {article_id}: {response.status_code} {response.text}")
 
-def main():
-    articles = fetch_articles_to_analyze()
-    for article in articles:
+# `on_analyzed(article, data)` runs after each article's columns are written
+async def analyze_articles(articles, fused=False, on_analyzed=None, max_concurrency=LLM_MAX_CONCURRENCY):
+    dispatcher = LLMDispatcher(max_concurrency=max_concurrency)
+
+    async def analyze_and_store(article):
         print(f"🧠 Analyzing article {article['id']}")
-        result = analyze_article(article["full_content"])
-        if result:
-            update_article_analysis(article["id"], result)
-        print("⏳ Waiting 3 seconds to rate-limit OpenAI...")
-        time.sleep(3)
+        data = await analyze_article(article, dispatcher, fused)
+        if data:
+            await asyncio.to_thread(update_article_analysis, article["id"], data)
+            if on_analyzed:
+                await asyncio.to_thread(on_analyzed, article, data)
+
+    await process_rows(articles, analyze_and_store, max_pending=max_concurrency * 2)
+
+# Overnight path: cached responses are applied directly, everything else goes
+# through one OpenAI batch and is written back when the batch completes. A batch
+# is a single round of requests, so long articles are truncated to the token
+# budget here rather than map-reduced.
+def analyze_articles_batch(articles, fused=False):
+    stage = "analyze_fused" if fused else "analyze"
+    build_request = build_fused_request if fused else build_analysis_request
+    model = cache_identity(fused)[0]
+
+    def build_items():
+        items = []
+        cached = []
+        for article in articles:
+            content = clean_content(article["full_content"])
+            response = summary_cache.get(content, *cache_identity(fused))
+            data = build_article_update(article["id"], response, fused) if response is not None else None
+            if data is not None:
+                cached.append({"id": article["id"], **data})
+            else:
+                items.append((article["id"], build_request(truncate_to_tokens(content, ANALYSIS_CONTENT_TOKENS, model)), content))
+        if cached:
+            print(f"♻️ Reusing {len(cached)} cached summaries")
+            patch_rows("articles", cached)
+        return items
+
+    def apply_results(results):
+        rows = []
+        for article_id, response, content in results:
+            data = build_article_update(article_id, response, fused)
+            if data is None:
+                continue
+            if content is not None:
+                summary_cache.put(content, *cache_identity(fused), response)
+            rows.append({"id": article_id, **data})
+        patch_rows("articles", rows)
+
+    run_batch(stage, build_items, apply_results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize scraped articles")
+    parser.add_argument("--batch", action="store_true", help="submit through the OpenAI Batch API and wait for the results")
+    parser.add_argument("--fused", action="store_true", help="summarize and enrich in one call, leaving nothing for enrich_articles.py")
+    args = parser.parse_args()
+    if args.batch:
+        analyze_articles_batch(fetch_articles_to_analyze(), fused=args.fused)
+    else:
+        asyncio.run(analyze_articles(fetch_articles_to_analyze(), fused=args.fused))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,63 +1,303 @@
 import os
 import requests
-from newspaper import Article
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from newspaper import Article, Config
+from newspaper.network import _get_html_from_response
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+import queue
+import threading
+import multiprocessing
 import time
+from supabase_rest import get_session, iter_rows
+from near_duplicates import CONTENT_INDEX_PATH, get_index, find_existing, minhash
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Total scrapes in flight, scrapes in flight per publisher, and the pause
+# between consecutive requests to the same publisher
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "8"))
+SCRAPE_DOMAIN_CONCURRENCY = int(os.getenv("SCRAPE_DOMAIN_CONCURRENCY", "1"))
+SCRAPE_DOMAIN_DELAY = float(os.getenv("SCRAPE_DOMAIN_DELAY", "2"))
+SCRAPE_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT", "15"))
+# Parse processes, and how many downloaded pages may wait for a parser
+SCRAPE_PARSE_WORKERS = int(os.getenv("SCRAPE_PARSE_WORKERS", str(os.cpu_count() or 1)))
+SCRAPE_QUEUE_SIZE = int(os.getenv("SCRAPE_QUEUE_SIZE", "32"))
+# Failed URLs wait SCRAPE_BACKOFF_HOURS * 2^(attempts - 1) before the next try and
+# are dead-lettered (never fetched again) once they reach SCRAPE_MAX_ATTEMPTS
+SCRAPE_MAX_ATTEMPTS = int(os.getenv("SCRAPE_MAX_ATTEMPTS", "5"))
+SCRAPE_BACKOFF_HOURS = float(os.getenv("SCRAPE_BACKOFF_HOURS", "1"))
+
+# Shared connection pool for publisher sites (kept apart from the Supabase session
+# so our API key is never sent to third parties)
+scrape_session = requests.Session()
+scrape_session.headers["User-Agent"] = Config().browser_user_agent
+scrape_adapter = HTTPAdapter(pool_connections=100, pool_maxsize=SCRAPE_WORKERS)
+scrape_session.mount("https://", scrape_adapter)
+scrape_session.mount("http://", scrape_adapter)
+
 def fetch_unscraped_articles():
-    url = f"{SUPABASE_URL}/rest/v1/articles?scraped=eq.false&select=id,url"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Accept-Profile": "news"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else []
+    return iter_rows("articles", "id,url,scrape_attempts,last_scrape_attempt_at", {
+        "scraped": "eq.false",
+        "canonical_article_id": "is.null",
+        "or": f"(scrape_attempts.is.null,scrape_attempts.lt.{SCRAPE_MAX_ATTEMPTS})"
+    })
 
-def scrape_article_content(url):
+def is_due_for_retry(article, now):
+    attempts = article.get("scrape_attempts") or 0
+    if not attempts or not article.get("last_scrape_attempt_at"):
+        return True
+    last_attempt = datetime.fromisoformat(article["last_scrape_attempt_at"])
+    if last_attempt.tzinfo is None:
+        last_attempt = last_attempt.replace(tzinfo=timezone.utc)
+    backoff = timedelta(hours=SCRAPE_BACKOFF_HOURS * 2 ** (attempts - 1))
+    return now - last_attempt >= backoff
+
+def download_article_html(url):
+    try:
+        response = scrape_session.get(url, timeout=SCRAPE_TIMEOUT)
+        response.raise_for_status()
+        # newspaper's own decoding: requests assumes ISO-8859-1 for text/html
+        # without a charset header, so those pages go through as raw bytes or
+        # with the <meta charset> instead of being garbled
+        return _get_html_from_response(response)
+    except Exception as e:
+        print(f"❌ Failed to scrape {url}: {e}")
+        return None
+
+# CPU-bound lxml extraction; runs in a worker process
+def parse_article_html(url, html):
     try:
         article = Article(url)
-        article.download()
+        article.download(input_html=html)
         article.parse()
         return article.text
     except Exception as e:
-        print(f"❌ Failed to scrape {url}: {e}")
+        print(f"❌ Failed to parse {url}: {e}")
         return None
 
-def update_article_content(article_id, content):
+def scrape_article_content(url):
+    html = download_article_html(url)
+    return parse_article_html(url, html) if html else None
+
+def patch_article(article_id, data):
     url = f"{SUPABASE_URL}/rest/v1/articles?id=eq.{article_id}"
     headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
         "Content-Type": "application/json",
         "Prefer": "return=minimal",
         "Content-Profile": "news"
     }
+    try:
+        response = get_session().patch(url, headers=headers, json=data, timeout=30)
+    except requests.RequestException as e:
+        print(f"⚠️ Failed to update article {article_id}: {e}")
+        return
+    if response.status_code not in [200, 204]:
+        print(f"⚠️ Failed to update article {article_id}: {response.status_code} {response.text}")
+
+def update_article_content(article, content, canonical_id=None):
     data = {
         "full_content": content,
         "scraped": True,
         "last_scrape_attempt_at": datetime.utcnow().isoformat(),
-        "scrape_attempts": 1
+        "scrape_attempts": (article.get("scrape_attempts") or 0) + 1
     }
-    response = requests.patch(url, headers=headers, json=data)
-    if response.status_code not in [200, 204]:
-        print(f"⚠️ Failed to update article {article_id}: {response.status_code} {response.text}")
+    if canonical_id:
+        data["canonical_article_id"] = canonical_id
+    patch_article(article["id"], data)
 
-def main():
-    articles = fetch_unscraped_articles()
-    for a in articles:
+# Copies that only differ in headline or teaser are caught once the body is in:
+# returns the id of an earlier article with near-identical content, or indexes
+# this one as a new original
+def find_content_duplicate(article, content):
+    index = get_index(CONTENT_INDEX_PATH)
+    signature = minhash(content)
+    # An article whose write-back failed is scraped again with its own
+    # signature already indexed; it must not become its own duplicate
+    canonical_id = find_existing(index, signature, exclude=article["id"])
+    if canonical_id is None:
+        index.add(article["id"], signature)
+    else:
+        print(f"🧬 {article['url']} duplicates article {canonical_id}")
+    return canonical_id
+
+def record_scrape_failure(article):
+    attempts = (article.get("scrape_attempts") or 0) + 1
+    patch_article(article["id"], {
+        "last_scrape_attempt_at": datetime.utcnow().isoformat(),
+        "scrape_attempts": attempts
+    })
+    if attempts >= SCRAPE_MAX_ATTEMPTS:
+        print(f"🪦 Giving up on {article['url']} after {attempts} attempts")
+
+def article_domain(article):
+    return urlparse(article["url"]).netloc.lower()
+
+# Per-publisher queues for callers that scrape articles as they arrive rather
+# than in pre-built lanes. get() hands out the next article whose publisher is
+# free (at most `concurrency` requests in flight per domain, spaced at least
+# `delay` seconds apart), so a run of one publisher's URLs never keeps workers
+# from the others. Publishers take turns; call release() once an article's
+# download is done and close() when no more articles will be put.
+class DomainQueues:
+    def __init__(self, concurrency=SCRAPE_DOMAIN_CONCURRENCY, delay=SCRAPE_DOMAIN_DELAY):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.active = defaultdict(int)
+        self.last_request = {}
+        self.closed = False
+
+    def put(self, article):
+        with self.cond:
+            self.pending.setdefault(article_domain(article), deque()).append(article)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    # Blocks until some publisher is free; None once closed and empty
+    def get(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                wake_at = None
+                for domain, articles in self.pending.items():
+                    if self.active[domain] >= self.concurrency:
+                        continue
+                    ready_at = self.last_request.get(domain, 0) + self.delay
+                    if ready_at <= now:
+                        article = articles.popleft()
+                        # Re-inserting moves the domain to the back of the line
+                        del self.pending[domain]
+                        if articles:
+                            self.pending[domain] = articles
+                        self.active[domain] += 1
+                        return article
+                    wake_at = ready_at if wake_at is None else min(wake_at, ready_at)
+                if self.closed and not self.pending:
+                    return None
+                self.cond.wait(None if wake_at is None else wake_at - now)
+
+    def release(self, article):
+        domain = article_domain(article)
+        with self.cond:
+            self.active[domain] -= 1
+            self.last_request[domain] = time.monotonic()
+            self.cond.notify_all()
+
+# Scrape one article taken from `domains` end to end and write the result back.
+# Returns the content for an original article, or None if scraping failed or it
+# duplicates another.
+def scrape_and_store(article, parse_pool, domains):
+    print(f"🔍 Scraping: {article['url']}")
+    try:
+        html = download_article_html(article["url"])
+    finally:
+        domains.release(article)
+    content = parse_pool.submit(parse_article_html, article["url"], html).result() if html else None
+    if not content:
+        record_scrape_failure(article)
+        return None
+    canonical_id = find_content_duplicate(article, content)
+    update_article_content(article, content, canonical_id)
+    return None if canonical_id else content
+
+# Download one publisher's share of the backlog sequentially, pausing between
+# requests. Blocks when the parse queue is full so memory stays bounded, and
+# gives up on the rest of the lane once `stop` is set.
+def download_lane(articles, html_queue, stop):
+    for i, a in enumerate(articles):
+        if stop.is_set():
+            return
+        if i:
+            time.sleep(SCRAPE_DOMAIN_DELAY)
         print(f"🔍 Scraping: {a['url']}")
-        content = scrape_article_content(a["url"])
-        if content:
-            update_article_content(a["id"], content)
-        print("🕒 Sleeping 2 seconds to be polite...")
-        time.sleep(2)
+        html = download_article_html(a["url"])
+        if html:
+            html_queue.put((a, html))
+        else:
+            record_scrape_failure(a)
+
+def build_lanes(articles):
+    by_domain = defaultdict(list)
+    for a in articles:
+        by_domain[article_domain(a)].append(a)
+    lanes = []
+    for domain_articles in by_domain.values():
+        lane_count = min(SCRAPE_DOMAIN_CONCURRENCY, len(domain_articles))
+        lanes.extend(domain_articles[i::lane_count] for i in range(lane_count))
+    # Longest lanes first so the busiest publishers never end up as the tail
+    lanes.sort(key=len, reverse=True)
+    return lanes
+
+def main():
+    # Rows are small, and lanes need the whole backlog to group by publisher
+    now = datetime.now(timezone.utc)
+    articles = [a for a in fetch_unscraped_articles() if is_due_for_retry(a, now)]
+    lanes = build_lanes(articles)
+    print(f"📰 Scraping {len(articles)} articles across {len(lanes)} publisher lanes")
+    html_queue = queue.Queue(maxsize=SCRAPE_QUEUE_SIZE)
+    stop = threading.Event()
+
+    # Parse processes are spawned rather than forked: the lane threads are
+    # already running when the first one starts, and a fork could copy a held lock
+    spawn = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=SCRAPE_PARSE_WORKERS, mp_context=spawn) as parse_pool:
+        downloads = [fetch_pool.submit(download_lane, lane, html_queue, stop) for lane in lanes]
+
+        def close_queue():
+            wait(downloads)
+            html_queue.put(None)
+        threading.Thread(target=close_queue, daemon=True).start()
+
+        # Keep at most two pages per parse process in flight; the rest wait in the queue
+        parsing = {}
+
+        def write_results(done):
+            for future in done:
+                a = parsing.pop(future)
+                try:
+                    content = future.result()
+                    if content:
+                        update_article_content(a, content, find_content_duplicate(a, content))
+                    else:
+                        record_scrape_failure(a)
+                except Exception as e:
+                    print(f"❌ Failed to store {a['url']}: {e}")
+
+        try:
+            while True:
+                item = html_queue.get()
+                if item is None:
+                    break
+                a, html = item
+                parsing[parse_pool.submit(parse_article_html, a["url"], html)] = a
+                if len(parsing) >= SCRAPE_PARSE_WORKERS * 2:
+                    done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                    write_results(done)
+            write_results(wait(parsing).done)
+        except BaseException:
+            # Lanes blocked on a full queue would otherwise keep the pool from
+            # ever shutting down: stop them and empty the queue until they finish
+            stop.set()
+            while html_queue.get() is not None:
+                pass
+            raise
+
+        for download in downloads:
+            download.result()
+    get_index(CONTENT_INDEX_PATH).save()
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,18 @@
 import os
 import json
+import time
+import argparse
+from functools import lru_cache
 import pandas as pd
 from supabase import create_client, Client
 from bertopic import BERTopic
 from datetime import datetime
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import CountVectorizer
+from keyword_matcher import KeywordTopicClassifier, invert_topic_keywords
+from embedding_store import EmbeddingStore
+from embedding_engine import EmbeddingEngine
+from supabase_rest import chunked, BULK_CHUNK_SIZE
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +25,14 @@ assert SUPABASE_URL and SUPABASE_KEY, "Supabase credentials missing from .env"
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+MODEL_PATH = os.getenv("BERTOPIC_MODEL_PATH", "bertopic_model")
+# Days between full refits; runs in between only assign topics to new articles
+REFIT_DAYS = float(os.getenv("BERTOPIC_REFIT_DAYS", "7"))
+# Most recent summaries a full refit is trained on
+FIT_WINDOW = int(os.getenv("BERTOPIC_FIT_WINDOW", "500"))
+PAGE_SIZE = 1000
+ID_BATCH_SIZE = 200
+
 # Load keyword-to-topic mapping
 try:
     with open("topic_mappings.json") as f:
@@ -26,71 +40,176 @@ try:
 except FileNotFoundError:
     print("⚠️ Mapping file 'topic_mappings.json' not found. Proceeding without keyword remapping.")
     topic_map = {}
+# The file lists keywords per topic; BERTopic keywords are looked up the other way
+topic_classifier = KeywordTopicClassifier(invert_topic_keywords(topic_map))
+
+def map_topic_keyword(keyword):
+    topics = topic_classifier.classify(keyword)
+    return topics[0] if topics else keyword
+
+def to_dataframe(rows):
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        df["published_at"] = pd.to_datetime(df["published_at"])
+    return df
 
 # Fetch summaries and timestamps
-def fetch_articles(limit=500):
-    response = supabase.schema("news").table("articles") \
+def fetch_articles(limit=FIT_WINDOW):
+    response = supabase.schema(SUPABASE_SCHEMA).table("articles") \
         .select("id, summary, published_at") \
         .filter("summary", "not.is", "null") \
         .order("published_at", desc=True) \
         .limit(limit) \
         .execute()
-    return pd.DataFrame(response.data)
-
-df = fetch_articles()
-
-if df.empty:
-    print("⚠️ No summarized articles found.")
-    exit()
-
-# Convert timestamps
-df["published_at"] = pd.to_datetime(df["published_at"])
-
-# Generate embeddings and model topics
-print("🔍 Fitting BERTopic model...")
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-vectorizer_model = CountVectorizer(stop_words="english", ngram_range=(1, 2))
-topic_model = BERTopic(embedding_model=embedding_model, vectorizer_model=vectorizer_model, min_topic_size=10)
-
-topics, probs = topic_model.fit_transform(df["summary"].tolist())
-
-# Attach topics to DataFrame
-df["topic"] = topics
-
-# Show top topics
-print("\n🧠 Top Topics:")
-print(topic_model.get_topic_info().head(10))
-
-# Upsert into Supabase bertopic_topics table
-print("⬆️  Upserting topic labels to Supabase...")
-for i, row in df.iterrows():
-    topic_id = row["topic"]
-    article_id = row["id"]
-    topic_info = topic_model.get_topic(topic_id)
-    keywords = [kw for kw, _ in topic_info]
-    mapped_keywords = [topic_map.get(k.lower(), k) for k in keywords[:3]]
-    topic_name = ", ".join(mapped_keywords)
-    probability = probs[i] if probs is not None else None
-
-    supabase.schema("news").table("bertopic_topics").upsert({
-        "article_id": article_id,
-        "topic_id": topic_id,
-        "topic_keywords": keywords,
-        "topic_name": topic_name,
-        "probability": float(probability) if probability is not None else None,
-    }).execute()
-
-# Optional: visualize
-try:
-    fig = topic_model.visualize_barchart(top_n_topics=10)
-    fig.write_html("topic_barchart.html")
-    print("\n📊 Topic bar chart saved to topic_barchart.html")
-except Exception as e:
-    print(f"⚠️ Visualization error: {e}")
-
-# Optional: Save topic model
-topic_model.save("bertopic_model")
-
-# Optional: Save topic-labeled data
-df.to_csv("topic_labeled_articles.csv", index=False)
-print("✅ Topic-labeled articles saved to topic_labeled_articles.csv")
\ No newline at end of file
+    return to_dataframe(response.data)
+
+# Walk one column of `table` in key order, a page at a time
+def iter_column(table, column, filters=()):
+    last = None
+    while True:
+        query = supabase.schema(SUPABASE_SCHEMA).table(table).select(column)
+        for args in filters:
+            query = query.filter(*args)
+        if last is not None:
+            query = query.gt(column, last)
+        rows = query.order(column).limit(PAGE_SIZE).execute().data
+        if not rows:
+            return
+        for row in rows:
+            yield row[column]
+        last = rows[-1][column]
+
+# Summarized articles that have no bertopic_topics row yet. Only ids are
+# listed for the whole table; summaries are fetched for the new ones alone.
+def fetch_unassigned_articles():
+    assigned = set(iter_column("bertopic_topics", "article_id"))
+    new_ids = [
+        article_id for article_id in iter_column("articles", "id", [("summary", "not.is", "null")])
+        if article_id not in assigned
+    ]
+    rows = []
+    for start in range(0, len(new_ids), ID_BATCH_SIZE):
+        response = supabase.schema(SUPABASE_SCHEMA).table("articles") \
+            .select("id, summary, published_at") \
+            .in_("id", new_ids[start:start + ID_BATCH_SIZE]) \
+            .execute()
+        rows.extend(response.data)
+    return to_dataframe(rows)
+
+@lru_cache(maxsize=None)
+def get_embedding_engine():
+    return EmbeddingEngine()
+
+# Summary embeddings come from the on-disk store; only articles that are new or
+# whose summary changed are encoded
+def embed_summaries(df):
+    engine = get_embedding_engine()
+    store = EmbeddingStore(engine.name)
+    return store.embed(df["id"].tolist(), df["summary"].tolist(), engine.encode)
+
+def refit_due():
+    if not os.path.exists(MODEL_PATH):
+        return True
+    age_days = (time.time() - os.path.getmtime(MODEL_PATH)) / 86400
+    return age_days >= REFIT_DAYS
+
+def fit_topic_model(df):
+    print(f"🔍 Fitting BERTopic model on {len(df)} articles...")
+    embeddings = embed_summaries(df)
+    vectorizer_model = CountVectorizer(stop_words="english", ngram_range=(1, 2))
+    topic_model = BERTopic(embedding_model=get_embedding_engine().model, vectorizer_model=vectorizer_model, min_topic_size=10)
+    topics, probs = topic_model.fit_transform(df["summary"].tolist(), embeddings=embeddings)
+
+    # Show top topics
+    print("\n🧠 Top Topics:")
+    print(topic_model.get_topic_info().head(10))
+
+    # Optional: visualize
+    try:
+        fig = topic_model.visualize_barchart(top_n_topics=10)
+        fig.write_html("topic_barchart.html")
+        print("\n📊 Topic bar chart saved to topic_barchart.html")
+    except Exception as e:
+        print(f"⚠️ Visualization error: {e}")
+
+    # The saved model (including its UMAP and HDBSCAN state) is what later
+    # incremental runs transform new articles with
+    topic_model.save(MODEL_PATH)
+    print(f"💾 Saved topic model to {MODEL_PATH}")
+    return topic_model, topics, probs
+
+def assign_topics(df):
+    print(f"📂 Loading topic model from {MODEL_PATH}")
+    topic_model = BERTopic.load(MODEL_PATH)
+    print(f"🔍 Assigning topics to {len(df)} new articles...")
+    topics, probs = topic_model.transform(df["summary"].tolist(), embeddings=embed_summaries(df))
+    return topic_model, topics, probs
+
+# Keywords and display name for each topic, looked up once per topic rather
+# than once per article
+def topic_metadata(topic_model, topic_ids):
+    metadata = {}
+    for topic_id in set(topic_ids):
+        keywords = [kw for kw, _ in topic_model.get_topic(topic_id) or []]
+        mapped_keywords = [map_topic_keyword(k) for k in keywords[:3]]
+        metadata[topic_id] = {"topic_keywords": keywords, "topic_name": ", ".join(mapped_keywords)}
+    return metadata
+
+def upsert_topic_assignments(topic_model, df, probs):
+    topic_ids = df["topic"].astype(int)
+    metadata = topic_metadata(topic_model, topic_ids)
+    rows = pd.DataFrame({
+        "article_id": df["id"],
+        "topic_id": topic_ids,
+        "topic_keywords": topic_ids.map(lambda t: metadata[t]["topic_keywords"]),
+        "topic_name": topic_ids.map(lambda t: metadata[t]["topic_name"]),
+        "probability": pd.Series(probs, index=df.index, dtype=float) if probs is not None else None,
+    })
+    rows = rows.astype(object).where(rows.notna(), None).to_dict("records")
+
+    # Upsert into Supabase bertopic_topics table
+    print(f"⬆️  Upserting {len(rows)} topic labels across {len(metadata)} topics to Supabase...")
+    failed = 0
+    for chunk in chunked(rows, BULK_CHUNK_SIZE):
+        try:
+            supabase.schema(SUPABASE_SCHEMA).table("bertopic_topics").upsert(chunk).execute()
+        except Exception as e:
+            failed += len(chunk)
+            print(f"❌ Failed to upsert {len(chunk)} topic labels: {e}")
+    if failed:
+        print(f"⚠️ {failed} topic labels were not written")
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign BERTopic topics to summarized articles")
+    parser.add_argument("--refit", action="store_true", help="refit the model on the latest articles even if a refit isn't due")
+    args = parser.parse_args()
+
+    # Full refits are periodic; in between, only articles without a topic are
+    # embedded and transformed with the saved model, so a run costs time in
+    # proportion to the day's new articles rather than the fit window
+    refit = args.refit or refit_due()
+    if refit:
+        df = fetch_articles()
+        if df.empty:
+            print("⚠️ No summarized articles found.")
+            return
+        topic_model, topics, probs = fit_topic_model(df)
+    else:
+        df = fetch_unassigned_articles()
+        if df.empty:
+            print("✅ No new articles need topics.")
+            return
+        topic_model, topics, probs = assign_topics(df)
+
+    # Attach topics to DataFrame
+    df["topic"] = topics
+    upsert_topic_assignments(topic_model, df, probs)
+
+    # Optional: Save topic-labeled data. Only a refit covers the whole fit
+    # window; an incremental run's few new articles would replace the file.
+    if refit:
+        df.to_csv("topic_labeled_articles.csv", index=False)
+        print("✅ Topic-labeled articles saved to topic_labeled_articles.csv")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import csv
+import time
+import argparse
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch", "onnx" (same weights exported to ONNX Runtime) or "onnx-int8"
+# (dynamically quantized ONNX export, faster on CPU with slightly different vectors)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# CPU threads for inference; 0 leaves the library default
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# Quantized file in the model repo; pick the variant matching the CPU
+# (model_qint8_avx512.onnx, model_qint8_arm64.onnx, ...)
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Encodes texts with a SentenceTransformer under an explicit backend, batch
+# size and thread count. SentenceTransformer.encode already sorts each call's
+# texts by length before batching, so callers should pass all their texts in
+# one call rather than looping in small groups.
+class EmbeddingEngine:
+    def __init__(self, model_name=EMBEDDING_MODEL, backend=EMBEDDING_BACKEND,
+                 batch_size=EMBEDDING_BATCH_SIZE, threads=EMBEDDING_THREADS):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        self.batch_size = batch_size
+        self.backend = backend
+        # Quantized vectors aren't interchangeable with full-precision ones, so
+        # they are stored under their own name
+        self.name = f"{model_name}@int8" if backend == "onnx-int8" else model_name
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.model = self._load(model_name, backend, threads)
+
+    def _load(self, model_name, backend, threads):
+        if backend == "torch":
+            return SentenceTransformer(model_name, device="cpu")
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if backend == "onnx-int8":
+            model_kwargs["file_name"] = EMBEDDING_ONNX_INT8_FILE
+        if threads > 0:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = threads
+            model_kwargs["session_options"] = session_options
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    def encode(self, texts):
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        embeddings = self.model.encode(
+            list(texts), batch_size=self.batch_size, show_progress_bar=False, convert_to_numpy=True
+        )
+        return embeddings.astype(np.float32, copy=False)
+
+def load_benchmark_texts(path, limit):
+    with open(path, newline="") as f:
+        texts = [row["summary"] for row in csv.DictReader(f) if row.get("summary")]
+    return texts[:limit]
+
+def mean_cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float(np.mean(np.sum(a * b, axis=1)))
+
+# Encode the same summaries under each backend and batch size and report
+# sentences/sec, plus how closely each configuration's vectors agree with torch
+def run_benchmark(texts, backends, batch_sizes, threads):
+    print(f"⏱️ Benchmarking {EMBEDDING_MODEL} on {len(texts)} summaries ({threads or 'default'} threads)")
+    reference = None
+    for backend in backends:
+        try:
+            engine = EmbeddingEngine(backend=backend, threads=threads)
+        except Exception as e:
+            print(f"⚠️ {backend}: unavailable ({e})")
+            continue
+        engine.encode(texts[:engine.batch_size])  # warm-up
+        for batch_size in batch_sizes:
+            engine.batch_size = batch_size
+            started = time.perf_counter()
+            embeddings = engine.encode(texts)
+            elapsed = time.perf_counter() - started
+            if backend == "torch" and reference is None:
+                reference = embeddings
+            agreement = f", cosine vs torch {mean_cosine(embeddings, reference):.4f}" if reference is not None and backend != "torch" else ""
+            print(f"📈 {backend:<9} batch {batch_size:>4}: {len(texts) / elapsed:8.1f} sentences/sec{agreement}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark summary embedding configurations")
+    parser.add_argument("--input", default="topic_labeled_articles.csv", help="CSV with a summary column")
+    parser.add_argument("--limit", type=int, default=1000, help="number of summaries to encode")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--batch-sizes", default="16,32,64,128")
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS)
+    args = parser.parse_args()
+    texts = load_benchmark_texts(args.input, args.limit)
+    if not texts:
+        print(f"⚠️ No summaries found in {args.input}")
+        return
+    run_benchmark(
+        texts,
+        [b.strip() for b in args.backends.split(",") if b.strip()],
+        [int(b) for b in args.batch_sizes.split(",")],
+        args.threads
+    )
+
+if __name__ == "__main__":
+    main()
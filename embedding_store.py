@@ -0,0 +1,83 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "embeddings")
+
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+# Article embeddings computed once and kept on disk: one float32 matrix per
+# model, read through a memory map, plus a JSON index of article id -> (row,
+# hash of the text that row was computed from). An article whose text changes
+# gets a new row; the old one is simply no longer referenced.
+class EmbeddingStore:
+    def __init__(self, model_name, path=EMBEDDING_STORE_DIR):
+        os.makedirs(path, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.model_name = model_name
+        self.data_path = os.path.join(path, f"{slug}.f32")
+        self.index_path = os.path.join(path, f"{slug}.index.json")
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {"model": model_name, "dim": None, "rows": 0, "ids": {}}
+        self.dim = index["dim"]
+        self.rows = index["rows"]
+        self.ids = index["ids"]
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "rows": self.rows, "ids": self.ids}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _matrix(self):
+        if not self.rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.data_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+
+    def _append(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        # Rows written by a run that died before saving the index are dropped
+        expected_size = self.rows * self.dim * 4
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) != expected_size:
+            os.truncate(self.data_path, expected_size)
+        with open(self.data_path, "ab") as f:
+            vectors.tofile(f)
+        first_row = self.rows
+        self.rows += len(vectors)
+        return range(first_row, self.rows)
+
+    # Stored vectors for `ids` (None where an id has none), without encoding
+    def get(self, ids):
+        matrix = self._matrix()
+        found = []
+        for article_id in ids:
+            entry = self.ids.get(str(article_id))
+            found.append(np.array(matrix[entry[0]]) if entry else None)
+        return found
+
+    # Embeddings for `texts` keyed by `ids`, as one float32 array in the same
+    # order. Only texts with no stored vector (or whose text changed) go through
+    # `encode`, which takes a list of strings and returns a 2-D array.
+    def embed(self, ids, texts, encode):
+        ids = [str(article_id) for article_id in ids]
+        hashes = [text_hash(text) for text in texts]
+        missing = [
+            i for i, (article_id, digest) in enumerate(zip(ids, hashes))
+            if self.ids.get(article_id, (None, None))[1] != digest
+        ]
+        if missing:
+            print(f"🧮 Embedding {len(missing)} of {len(ids)} texts with {self.model_name}")
+            rows = self._append(encode([texts[i] for i in missing]))
+            for i, row in zip(missing, rows):
+                self.ids[ids[i]] = [row, hashes[i]]
+            self._save_index()
+        matrix = self._matrix()
+        return np.array(matrix[[self.ids[article_id][0] for article_id in ids]], dtype=np.float32)
@@ -1,11 +1,16 @@
 import os
+import asyncio
+import argparse
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from datetime import datetime
-import openai
-import time
-import json
 import yaml
+from pydantic import BaseModel, ConfigDict, ValidationError
+from supabase_rest import iter_rows, patch_rows, BufferedUpdater
+from llm_dispatch import LLMDispatcher, process_rows, LLM_MAX_CONCURRENCY
+from llm_batch import run_batch
+from keyword_matcher import KeywordTopicClassifier
 
 load_dotenv()
 
@@ -13,81 +18,179 @@ USE_OLLAMA = os.getenv("USE_OLLAMA", "false").lower() == "true"
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# Structured outputs need a model that supports json_schema response formats
+ENRICHMENT_MODEL = os.getenv("ENRICHMENT_MODEL", "gpt-4o-mini")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+# Requests kept in flight against the local server; match the server's own
+# OLLAMA_NUM_PARALLEL so every slot stays busy without queueing behind it
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+# How long the server keeps the model loaded after the last request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Covers time spent queued behind other slots as well as generation
+OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "120"))
+# Enriched articles collected before their updates are sent together
+ENRICH_FLUSH_SIZE = int(os.getenv("ENRICH_FLUSH_SIZE", "50"))
 
 def load_keyword_topic_mapping():
     try:
         with open("keyword_topic_mapping.yaml", "r") as f:
-            return yaml.safe_load(f)
+            return yaml.safe_load(f) or {}
     except Exception as e:
         print(f"⚠️ Failed to load keyword-topic mapping: {e}")
         return {}
 
 KEYWORD_TOPIC_MAP = load_keyword_topic_mapping()
+KEYWORD_TOPIC_CLASSIFIER = KeywordTopicClassifier(KEYWORD_TOPIC_MAP)
 
 def classify_additional_topics(summary_text):
-    assigned_topics = set()
-    if not summary_text:
-        return []
-    text_lower = summary_text.lower()
-    for keyword, topic in KEYWORD_TOPIC_MAP.items():
-        if keyword.lower() in text_lower:
-            assigned_topics.add(topic)
-    return list(assigned_topics)
+    return KEYWORD_TOPIC_CLASSIFIER.classify(summary_text)
 
 def fetch_summaries_to_enrich():
-    url = f"{SUPABASE_URL}/rest/v1/articles?select=id,summary&needs_enrichment=eq.true"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Accept-Profile": "news"
+    return iter_rows("articles", "id,url,summary", {"needs_enrichment": "eq.true", "canonical_article_id": "is.null"})
+
+# Shared with the fused analysis prompt in analyze_articles.py
+ENRICHMENT_FORMAT_INSTRUCTIONS = "respond in JSON with the following keys:\n"
+ENRICHMENT_FIELDS = (
+    "- topics: list of strings\n"
+    "- entities: an object with keys agencies, companies, people, programs, each a list of names\n"
+    "- relevance_score: integer from 0 to 100, where 0 = completely irrelevant to government or budgetary concerns, 50 = moderately relevant, and 100 = critically relevant to U.S. federal procurement, policy, or agencies\n"
+    "- budget_mentions: list of strings (may be empty)\n"
+)
+
+# Response schemas: sent to the model as the required output format and used
+# to validate what comes back
+class EntityGroups(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    agencies: list[str]
+    companies: list[str]
+    people: list[str]
+    programs: list[str]
+
+class Enrichment(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    topics: list[str]
+    entities: EntityGroups
+    relevance_score: int
+    budget_mentions: list[str]
+
+class FusedAnalysis(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    summary: str
+    topics: list[str]
+    entities: EntityGroups
+    relevance_score: int
+    budget_mentions: list[str]
+
+def openai_response_format(schema_model):
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema_model.__name__,
+            "strict": True,
+            "schema": schema_model.model_json_schema()
+        }
     }
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else []
 
-def enrich_summary(summary_text):
+def build_enrichment_messages(summary_text):
     prompt = (
-        "You are an expert in government news analysis. Given the article summary below, respond ONLY in valid JSON format with the following keys. Do not include markdown backticks. Do not use JSON objects with values only (e.g., {\"Entity\"}); instead use key-value pairs like {\"Entity\": {}} or lists:\n"
-        "- topics: list of strings\n"
-        "- entities: an object with keys: agencies, companies, people, programs\n"
-        "- relevance_score: integer from 0 to 100, where 0 = completely irrelevant to government or budgetary concerns, 50 = moderately relevant, and 100 = critically relevant to U.S. federal procurement, policy, or agencies\n"
-        "- budget_mentions: list of strings (may be empty)\n\n"
-        f"Summary: {summary_text}"
+        "You are an expert in government news analysis. Given the article summary below, "
+        + ENRICHMENT_FORMAT_INSTRUCTIONS
+        + ENRICHMENT_FIELDS
+        + f"\nSummary: {summary_text}"
     )
+    return [
+        {"role": "system", "content": "You are an expert in government news analysis."},
+        {"role": "user", "content": prompt}
+    ]
+
+def build_enrichment_request(summary_text):
+    return {
+        "model": ENRICHMENT_MODEL,
+        "messages": build_enrichment_messages(summary_text),
+        "temperature": 0.4,
+        "max_tokens": 600,
+        "response_format": openai_response_format(Enrichment)
+    }
+
+def build_ollama_request(summary_text):
+    return {
+        "model": OLLAMA_MODEL,
+        "messages": build_enrichment_messages(summary_text),
+        "stream": False,
+        "format": Enrichment.model_json_schema(),
+        "keep_alive": OLLAMA_KEEP_ALIVE
+    }
+
+ollama_session = requests.Session()
+ollama_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_NUM_PARALLEL))
+ollama_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_NUM_PARALLEL))
+
+# Load the model before the first article so its load time isn't charged to
+# (or timed out on) a real request; a chat request without messages only loads it
+def preload_ollama_model():
+    try:
+        response = ollama_session.post(
+            f"{OLLAMA_URL}/api/chat",
+            json={"model": OLLAMA_MODEL, "messages": [], "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=OLLAMA_TIMEOUT
+        )
+        response.raise_for_status()
+        print(f"🧠 Ollama model {OLLAMA_MODEL} loaded (keep_alive {OLLAMA_KEEP_ALIVE}, {OLLAMA_NUM_PARALLEL} parallel)")
+    except Exception as e:
+        print(f"⚠️ Failed to preload Ollama model {OLLAMA_MODEL}: {e}")
+
+def ollama_chat(request, article_id=None):
+    try:
+        response = ollama_session.post(f"{OLLAMA_URL}/api/chat", json=request, timeout=OLLAMA_TIMEOUT)
+        response.raise_for_status()
+        result = response.json()
+    except Exception as e:
+        print(f"❌ Ollama error: {e}")
+        return None
+    # eval_duration is reported in nanoseconds
+    eval_count = result.get("eval_count")
+    eval_duration = result.get("eval_duration")
+    if eval_count and eval_duration:
+        print(f"⚡ Article {article_id}: {eval_count} tokens at {eval_count / (eval_duration / 1e9):.1f} tok/s")
+    return result.get("message", {}).get("content", "").strip()
+
+# Send `request` and validate the reply against `schema_model`. A reply that
+# fails validation gets one follow-up quoting the validation errors; returns
+# the validated model or None.
+async def request_validated(article_id, schema_model, request, send):
+    response = await send(request)
+    if not response:
+        return None
+    try:
+        return schema_model.model_validate_json(response)
+    except ValidationError as e:
+        print(f"⚠️ Invalid response for article {article_id} ({e.error_count()} errors), asking again")
+        retry = dict(request)
+        retry["messages"] = request["messages"] + [
+            {"role": "assistant", "content": response},
+            {"role": "user", "content": f"That reply does not match the required JSON schema:\n{e}\nReply again with only the corrected JSON."}
+        ]
+    response = await send(retry)
+    if not response:
+        return None
+    try:
+        return schema_model.model_validate_json(response)
+    except ValidationError as e:
+        print(f"⚠️ Invalid response for article {article_id} after re-ask: {e}")
+        return None
 
+async def enrich_summary(article_id, summary_text, dispatcher):
     if USE_OLLAMA:
-        try:
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={
-                    "model": "mistral",  # or another model installed in Ollama
-                    "prompt": prompt,
-                    "stream": False
-                },
-                timeout=30
-            )
-            result = response.json()
-            return result.get("response", "").strip()
-        except Exception as e:
-            print(f"❌ Ollama error: {e}")
-            return None
-    else:
-        try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are an expert in government news analysis."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.4,
-                max_tokens=600
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"❌ OpenAI error: {e}")
-            return None
+        return await request_validated(
+            article_id, Enrichment, build_ollama_request(summary_text),
+            lambda request: asyncio.to_thread(ollama_chat, request, article_id)
+        )
+    return await request_validated(
+        article_id, Enrichment, build_enrichment_request(summary_text),
+        lambda request: dispatcher.complete(**request)
+    )
 
 def normalize_entity_group(entity_group):
     if isinstance(entity_group, list) or isinstance(entity_group, set):
@@ -107,81 +210,96 @@ def normalize_entity_group(entity_group):
         return normalized
     return {}
 
-def update_article_enrichment(article_id, enriched_data, summary_text):
-    import re
-
-    url = f"{SUPABASE_URL}/rest/v1/articles?id=eq.{article_id}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal",
-        "Content-Profile": "news"
+# Article columns filled by a validated Enrichment (or FusedAnalysis, whose own
+# summary is then written too and used for the keyword topics)
+def enrichment_columns(enrichment, summary_text):
+    if isinstance(enrichment, FusedAnalysis):
+        summary_text = enrichment.summary.strip()
+    entities = {
+        group: normalize_entity_group(getattr(enrichment.entities, group))
+        for group in ["agencies", "companies", "people", "programs"]
+    }
+    all_topics = list(set(enrichment.topics).union(classify_additional_topics(summary_text)))
+    data = {
+        "topics": all_topics,
+        "entities": entities,
+        "relevance_score": max(0, min(100, enrichment.relevance_score)),
+        "last_analysis_at": datetime.utcnow().isoformat(),
+        "budget_mentions": [m.strip() for m in enrichment.budget_mentions if m.strip()]
     }
+    if isinstance(enrichment, FusedAnalysis):
+        data["summary"] = summary_text
+    return data
 
+# Validate a raw model reply (batch results, cached fused responses) into
+# article columns, or None if it doesn't match the schema
+def parse_enrichment(article_id, enriched_data, summary_text, schema_model=Enrichment):
     try:
-        # Strip Markdown code fences if present
-        if enriched_data.startswith("```"):
-            enriched_data = enriched_data.strip().strip("`").strip("json").strip()
-        # Fix object blocks that are actually sets (e.g., {"Some Agency"}) by converting them to {"Some Agency": {}}
-        enriched_data = re.sub(
-            r'"\w+":\s*{\s*"([^"]+)"\s*}', 
-            r'"\1": {}', 
-            enriched_data
-        )
-        # Attempt to repair common JSON errors such as missing commas in arrays
-        enriched_data = re.sub(r'"\s*([^\"]+)"\s*"', r'"\1"', enriched_data)  # clean errant whitespace
-        enriched_data = enriched_data.replace(']["', '],["')  # separate wrongly joined array strings
-        enriched_data = re.sub(r'(?<=[\]"}])\s*(?=["{\[])', r', ', enriched_data)  # add commas between objects if missing
-
-        parsed = json.loads(enriched_data)
-        entities = parsed.get("entities", {})
-        for group in ["agencies", "companies", "people", "programs"]:
-            entities[group] = normalize_entity_group(entities.get(group, {}))
-
-        original_topics = set(parsed.get("topics", []))
-        keyword_topics = set(classify_additional_topics(summary_text))
-        all_topics = list(original_topics.union(keyword_topics))
-
-        raw_score = parsed.get("relevance_score", 5)
-        relevance_score = max(0, min(100, int(raw_score)))
-
-        data = {
-            "topics": all_topics,
-            "entities": entities,
-            "relevance_score": relevance_score,
-            "last_analysis_at": datetime.utcnow().isoformat(),
-            "budget_mentions": [m.strip() for m in parsed.get("budget_mentions", []) if isinstance(m, str) and m.strip()]
-        }
-    except json.JSONDecodeError as e:
-        print(f"⚠️ JSON parse error for article {article_id}: {e}")
-        print(f"↪️ Raw response: {enriched_data}")
-        return
-
-    response = requests.patch(url, headers=headers, json=data)
-    if response.status_code not in [200, 204]:
-        print(f"⚠️ Failed to update article {article_id}: {response.status_code} {response.text}")
-    else:
-        print(f"✅ Successfully updated article {article_id}")
-        # Mark the article as enriched
-        patch_url = f"{SUPABASE_URL}/rest/v1/articles?id=eq.{article_id}"
-        patch_data = {"needs_enrichment": False}
-        patch_response = requests.patch(patch_url, headers=headers, json=patch_data)
-        if patch_response.status_code not in [200, 204]:
-            print(f"⚠️ Failed to mark article {article_id} as enriched: {patch_response.status_code} {patch_response.text}")
+        enrichment = schema_model.model_validate_json(enriched_data)
+    except ValidationError as e:
+        print(f"⚠️ Invalid response for article {article_id}: {e}")
+        return None
+    return enrichment_columns(enrichment, summary_text)
 
-def main():
-    articles = fetch_summaries_to_enrich()
-    for article in articles:
+# Everything an enriched article needs written, including clearing
+# needs_enrichment, as one row so it lands in a single request
+def enrichment_row(article, enrichment):
+    return {
+        "id": article["id"],
+        **enrichment_columns(enrichment, article["summary"]),
+        "needs_enrichment": False
+    }
+
+async def enrich_articles(articles, max_concurrency=LLM_MAX_CONCURRENCY):
+    dispatcher = None if USE_OLLAMA else LLMDispatcher(max_concurrency=max_concurrency)
+    if USE_OLLAMA:
+        await asyncio.to_thread(preload_ollama_model)
+    writer = BufferedUpdater("articles", flush_size=ENRICH_FLUSH_SIZE)
+
+    async def enrich_and_store(article):
         print(f"🔍 Enriching article {article['id']}")
-        enriched = enrich_summary(article["summary"])
+        enriched = await enrich_summary(article["id"], article["summary"], dispatcher)
         if enriched:
-            update_article_enrichment(article["id"], enriched, article["summary"])
-        if not USE_OLLAMA:
-            print("🕒 Sleeping 3 seconds to be polite...")
-            time.sleep(3)
-        else:
-            print("⚡ Skipping sleep for local model")
+            await asyncio.to_thread(writer.add, enrichment_row(article, enriched))
+
+    max_pending = OLLAMA_NUM_PARALLEL if USE_OLLAMA else max_concurrency * 2
+    try:
+        await process_rows(articles, enrich_and_store, max_pending=max_pending)
+    finally:
+        writer.flush()
+
+# Overnight path: every pending summary goes through one OpenAI batch and the
+# parsed results are written back when the batch completes
+def enrich_articles_batch(articles):
+    def build_items():
+        return [
+            (article["id"], build_enrichment_request(article["summary"]), {"summary": article["summary"]})
+            for article in articles
+        ]
+
+    def apply_results(results):
+        rows = []
+        for article_id, enriched, article in results:
+            try:
+                enrichment = Enrichment.model_validate_json(enriched)
+            except ValidationError as e:
+                print(f"⚠️ Invalid response for article {article_id}: {e}")
+                continue
+            rows.append(enrichment_row({"id": article_id, **article}, enrichment))
+        patch_rows("articles", rows)
+
+    run_batch("enrich", build_items, apply_results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrich article summaries with topics, entities and relevance")
+    parser.add_argument("--batch", action="store_true", help="submit through the OpenAI Batch API and wait for the results")
+    args = parser.parse_args()
+    if args.batch:
+        if USE_OLLAMA:
+            print("⚠️ --batch uses the OpenAI Batch API and ignores USE_OLLAMA")
+        enrich_articles_batch(fetch_summaries_to_enrich())
+    else:
+        asyncio.run(enrich_articles(fetch_summaries_to_enrich()))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,8 +2,11 @@ import os
 import requests
 import json
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 # Load environment variables from .env
@@ -13,25 +16,58 @@ API_KEY = os.getenv("GNEWS_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-def get_eligible_queries(tier="primary"):
-    from datetime import timezone
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Accept-Profile": "news"
-    }
-
-    url = f"{SUPABASE_URL}/rest/v1/search_queries?active=eq.true&tier=eq.{tier}"
-    response = requests.get(url, headers=headers)
+# GNews plan rate limit, and a cap on requests per run. The cap is counted in
+# memory, so it only bounds one run; keep it at or below the plan's daily quota
+# divided by the runs per day.
+GNEWS_REQUESTS_PER_SECOND = float(os.getenv("GNEWS_REQUESTS_PER_SECOND", "1"))
+GNEWS_MAX_REQUESTS_PER_RUN = int(os.getenv("GNEWS_MAX_REQUESTS_PER_RUN", "100"))
+GNEWS_MAX_WORKERS = int(os.getenv("GNEWS_MAX_WORKERS", "4"))
+
+class TokenBucket:
+    # Blocks callers to at most `rate` acquisitions per second and refuses
+    # any acquisition once `quota` has been spent.
+    def __init__(self, rate, capacity=1, quota=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.quota = quota
+        self.used = 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.quota is not None and self.used >= self.quota:
+                    return False
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.used += 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+gnews_limiter = TokenBucket(GNEWS_REQUESTS_PER_SECOND, quota=GNEWS_MAX_REQUESTS_PER_RUN)
+
+# All active queries, fetched once per run and shared by every tier lookup
+@lru_cache(maxsize=None)
+def fetch_active_queries():
+    url = f"{SUPABASE_URL}/rest/v1/search_queries?active=eq.true"
+    response = get_session().get(url, headers={"Accept-Profile": "news"}, timeout=30)
     if response.status_code != 200:
         print("❌ Failed to fetch search queries:", response.text)
-        return []
+        return ()
+    return tuple(response.json())
 
-    queries = response.json()
+def get_eligible_queries(tier="primary"):
     now = datetime.now(timezone.utc)
     eligible = []
-    for q in queries:
+    for q in fetch_active_queries():
+        if q.get("tier") != tier:
+            continue
         last_run = datetime.fromisoformat(q["last_run_at"]).astimezone(timezone.utc) if q["last_run_at"] else None
         min_interval = q.get("min_interval_hours", 24)
         if not last_run or (now - last_run) > timedelta(hours=min_interval):
@@ -41,7 +77,7 @@ def get_eligible_queries(tier="primary"):
 
 def fetch_news(query="technology", max_results=3):
     url = f"https://gnews.io/api/v4/search?q={query}&lang=en&max={max_results}&token={API_KEY}"
-    response = requests.get(url)
+    response = requests.get(url, timeout=30)
 
     if response.status_code != 200:
         print(f"❌ Error {response.status_code}: {response.text}")
@@ -51,105 +87,108 @@ def fetch_news(query="technology", max_results=3):
 
 
 # Insert articles into Supabase
-import requests
+from supabase_rest import get_session, patch_rows
+from near_duplicates import insert_articles_deduplicated, save_ingest_index
+from seen_urls import canonicalize_url, drop_seen, mark_seen, save_seen_urls
 
-def insert_articles_to_supabase(articles):
-    insert_count = 0
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "resolution=merge-duplicates",
-        "Content-Profile": "news"
-    }
-
-    for article in articles:
-        data = {
+def insert_articles_to_supabase(articles, on_inserted=None):
+    rows = [
+        {
             "title": article.get("title"),
-            "url": article.get("url"),
+            "url": canonicalize_url(article.get("url")),
             "description": article.get("description"),
             "source": article.get("source", {}).get("name"),
             "published_at": article.get("publishedAt"),
             "content_snippet": article.get("content"),
             "scraped": False,
         }
+        for article in articles
+    ]
+    rows = drop_seen(rows)
+    counts = insert_articles_deduplicated(rows, on_inserted)
+    mark_seen(rows, counts)
+    return counts["inserted"]
+
+# Write last_run_at/run_count for every query that ran. Only those two columns
+# are sent, as PATCHes, so edits made to a query during the run (deactivating
+# it, say) are kept.
+def update_query_metadata(query_entries):
+    now = datetime.utcnow().isoformat()
+    rows = [
+        {"id": entry["id"], "last_run_at": now, "run_count": (entry.get("run_count") or 0) + 1}
+        for entry in query_entries
+    ]
+    counts = patch_rows("search_queries", rows)
+    if counts["failed"]:
+        print(f"⚠️ Failed to update query metadata for {counts['failed']} queries")
+
+def fetch_news_rate_limited(query_text):
+    if not gnews_limiter.acquire():
+        print(f"⛔ GNews limit of {GNEWS_MAX_REQUESTS_PER_RUN} requests per run reached — skipping '{query_text}'")
+        return None
+    print(f"\n🔍 Running query: {query_text}")
+    try:
+        return fetch_news(query=query_text)
+    except requests.RequestException as e:
+        print(f"❌ Request failed for '{query_text}': {e}")
+        return {}
 
-        print("🔗 POSTing to:", f"{SUPABASE_URL}/rest/v1/articles")
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/articles",
-            headers=headers,
-            json=data
-        )
-
-        if response.status_code in [200, 201]:
-            print(f"✅ Inserted: {data['title']}")
-            insert_count += 1
-        elif response.status_code == 409:
-            print(f"⚠️ Duplicate: {data['title']}")
-        else:
-            print(f"❌ Failed: {data['title']} — {response.status_code} {response.text}")
-    return insert_count
+def record_query_results(query_entry, articles, on_inserted=None):
+    query_text = query_entry["query"]
+    if "articles" not in articles:
+        print(f"⚠️ No results for '{query_text}'")
+        return None
+    print(f"✅ Fetched {len(articles['articles'])} articles for '{query_text}'")
+    for a in articles["articles"]:
+        print(f"- {a['title']} ({a['source']['name']})")
+    return insert_articles_to_supabase(articles["articles"], on_inserted)
+
+# Fetch queries concurrently under the GNews rate limit; inserts run on a single
+# writer thread behind the fetches as results arrive.
+# Returns (query_entry, inserted) for every query that returned articles.
+def run_queries(query_entries, on_inserted=None):
+    results = []
+    with ThreadPoolExecutor(max_workers=GNEWS_MAX_WORKERS) as fetch_pool, \
+            ThreadPoolExecutor(max_workers=1) as write_pool:
+        fetches = {
+            fetch_pool.submit(fetch_news_rate_limited, entry["query"]): entry
+            for entry in query_entries
+        }
+        writes = []
+        for future in as_completed(fetches):
+            articles = future.result()
+            if articles is None:
+                continue
+            entry = fetches[future]
+            writes.append((entry, write_pool.submit(record_query_results, entry, articles, on_inserted)))
+        for entry, write in writes:
+            inserted = write.result()
+            if inserted is not None:
+                results.append((entry, inserted))
+    return results
+
+# `on_inserted` receives each batch of newly inserted original articles
+# ({"id", "url"} rows) as soon as it is written; the pipeline uses it to start
+# scraping them straight away
+def run_gnews(on_inserted=None):
+    # Per-run plan: each tier is resolved once and each query runs at most once
+    primary_queries = get_eligible_queries()
+    secondary_queries = get_eligible_queries(tier="secondary")
+    if not primary_queries:
+        print("ℹ️ No eligible primary queries — attempting secondary tier instead...")
+        completed = run_queries(secondary_queries, on_inserted)
+    else:
+        completed = run_queries(primary_queries, on_inserted)
+        low_yield = [(entry, inserted) for entry, inserted in completed if inserted < 10]
+        for entry, inserted in low_yield:
+            print(f"📉 Low insert count for '{entry['query']}' — only {inserted} new articles.")
+        if low_yield and secondary_queries:
+            print("🔁 Attempting fallback queries (tier: secondary)...")
+            completed += run_queries(secondary_queries, on_inserted)
+    update_query_metadata([entry for entry, _ in completed])
+    save_ingest_index()
+    save_seen_urls()
+    print(f"🚀 Finished all eligible queries ({gnews_limiter.used} GNews requests used).")
 
 if __name__ == "__main__":
-    eligible_queries = get_eligible_queries()
-    if not eligible_queries:
-        print("ℹ️ No eligible primary queries — attempting secondary tier instead...")
-        eligible_queries = get_eligible_queries(tier="secondary")
-    for query_entry in eligible_queries:
-        query_text = query_entry["query"]
-        print(f"\n🔍 Running query: {query_text}")
-        articles = fetch_news(query=query_text)
-        if "articles" in articles:
-            print(f"✅ Fetched {len(articles['articles'])} articles for '{query_text}'")
-            for a in articles["articles"]:
-                print(f"- {a['title']} ({a['source']['name']})")
-
-            # with open(f"news_output_{query_text.replace(' ', '_')}.json", "w") as f:
-            #     json.dump(articles, f, indent=2)
-            inserted = insert_articles_to_supabase(articles["articles"])
-            # Update query metadata
-            update_url = f"{SUPABASE_URL}/rest/v1/search_queries?id=eq.{query_entry['id']}"
-            update_data = {
-                "last_run_at": datetime.utcnow().isoformat(),
-                "run_count": query_entry.get("run_count", 0) + 1
-            }
-            update_headers = {
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}",
-                "Content-Type": "application/json",
-                "Prefer": "return=minimal",
-                "Content-Profile": "news"
-            }
-            update_response = requests.patch(update_url, headers=update_headers, json=update_data)
-            if update_response.status_code not in [200, 204]:
-                print(f"⚠️ Failed to update query metadata: {update_response.status_code} {update_response.text}")
-            if inserted < 10:
-                print(f"📉 Low insert count for '{query_text}' — only {inserted} new articles.")
-                print("🔁 Attempting fallback queries (tier: secondary)...")
-                fallback_queries = get_eligible_queries(tier="secondary")
-                for fallback in fallback_queries:
-                    fb_query_text = fallback["query"]
-                    print(f"\n🔍 Running fallback query: {fb_query_text}")
-                    articles = fetch_news(query=fb_query_text)
-                    if "articles" in articles:
-                        print(f"✅ Fetched {len(articles['articles'])} articles for fallback '{fb_query_text}'")
-                        inserted = insert_articles_to_supabase(articles["articles"])
-
-                        # Update fallback query metadata
-                        fb_update_url = f"{SUPABASE_URL}/rest/v1/search_queries?id=eq.{fallback['id']}"
-                        fb_update_data = {
-                            "last_run_at": datetime.utcnow().isoformat(),
-                            "run_count": fallback.get("run_count", 0) + 1
-                        }
-                        fb_update_response = requests.patch(fb_update_url, headers=update_headers, json=fb_update_data)
-                        if fb_update_response.status_code not in [200, 204]:
-                            print(f"⚠️ Failed to update fallback query metadata: {fb_update_response.status_code} {fb_update_response.text}")
-                    else:
-                        print(f"⚠️ No results for fallback query '{fb_query_text}'")
-                    print("🕒 Sleeping 3 seconds to avoid rate limiting...")
-                    time.sleep(3)
-        else:
-            print(f"⚠️ No results for '{query_text}'")
-        print("🕒 Sleeping 3 seconds to avoid rate limiting...")
-        time.sleep(3)
-    print("🚀 Finished all eligible queries.")
\ No newline at end of file
+    run_gnews()
@@ -0,0 +1,76 @@
+import re
+
+# Matches many keywords against a text in a single regex pass. The keywords are
+# folded into a character trie so the compiled pattern never backtracks across
+# alternatives, and every match must sit on word boundaries ("ai" no longer
+# matches inside "said").
+#
+# mode="token" matches each word of every keyword on its own (the RSS pipeline's
+# original behaviour); mode="phrase" only matches whole keyword phrases.
+
+def normalize_keyword(keyword):
+    return " ".join(keyword.lower().split())
+
+def _trie_pattern(node):
+    if "" in node and len(node) == 1:
+        return ""
+    alternatives = []
+    for char in sorted(k for k in node if k):
+        # A space in a phrase matches any run of whitespace in the text
+        prefix = r"\s+" if char == " " else re.escape(char)
+        alternatives.append(prefix + _trie_pattern(node[char]))
+    optional = "" in node
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+    pattern = "(?:" + "|".join(alternatives) + ")"
+    return pattern + "?" if optional else pattern
+
+def build_pattern(terms):
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return re.compile(r"(?<!\w)" + _trie_pattern(trie) + r"(?!\w)")
+
+class KeywordMatcher:
+    def __init__(self, keywords, mode="phrase"):
+        if mode not in ("phrase", "token"):
+            raise ValueError(f"Unknown match mode: {mode}")
+        terms = set()
+        for keyword in keywords:
+            keyword = normalize_keyword(keyword)
+            if mode == "token":
+                terms.update(keyword.split())
+            elif keyword:
+                terms.add(keyword)
+        self.terms = terms
+        self.pattern = build_pattern(terms) if terms else None
+
+    # Matched keywords (normalized, lowercase) in order of first appearance
+    def match(self, text):
+        if self.pattern is None or not text:
+            return []
+        found = {}
+        for m in self.pattern.finditer(text.lower()):
+            found.setdefault(" ".join(m.group(0).split()), None)
+        return list(found)
+
+# topic_mappings.json lists keywords per topic; the classifier wants the reverse
+def invert_topic_keywords(topic_keywords):
+    return {keyword: topic for topic, keywords in topic_keywords.items() for keyword in keywords}
+
+# Maps texts to topics through a {keyword: topic} mapping, compiled once into a
+# phrase KeywordMatcher so classifying is a single pass over the text
+class KeywordTopicClassifier:
+    def __init__(self, keyword_topics):
+        self.topics = {normalize_keyword(k): topic for k, topic in keyword_topics.items() if normalize_keyword(k)}
+        self.matcher = KeywordMatcher(self.topics, mode="phrase")
+
+    # Topics of the matched keywords, in order of first appearance
+    def classify(self, text):
+        found = {}
+        for keyword in self.matcher.match(text):
+            found.setdefault(self.topics[keyword], None)
+        return list(found)
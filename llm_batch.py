@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import openai
+
+# How often to check on a submitted batch
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "60"))
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def batch_state_path(stage):
+    return f"batch_state_{stage}.json"
+
+def load_batch_state(stage):
+    try:
+        with open(batch_state_path(stage)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_batch_state(stage, state):
+    tmp_path = f"{batch_state_path(stage)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, batch_state_path(stage))
+
+def submit_batch(client, stage, items):
+    input_path = f"batch_{stage}.jsonl"
+    with open(input_path, "w") as f:
+        for custom_id, request, _ in items:
+            f.write(json.dumps({
+                "custom_id": str(custom_id),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": request
+            }) + "\n")
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    # Saved straight away so a restart resumes this batch instead of paying for a new one
+    state = {
+        "batch_id": batch.id,
+        "context": {str(custom_id): context for custom_id, _, context in items}
+    }
+    save_batch_state(stage, state)
+    print(f"📤 Submitted batch {batch.id} with {len(items)} requests")
+    return state
+
+def wait_for_batch(client, batch_id):
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total})" if counts else ""
+        print(f"⏳ Batch {batch_id}: {batch.status}{progress}")
+        if batch.status in BATCH_FINAL_STATUSES:
+            return batch
+        time.sleep(BATCH_POLL_SECONDS)
+
+def read_batch_results(client, batch):
+    results = {}
+    if not batch.output_file_id:
+        return results
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"❌ Batch request {record['custom_id']} failed: {record.get('error') or response.get('body')}")
+            continue
+        results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+# Run one stage's prompts through the OpenAI Batch API. `build_items` returns
+# (custom_id, chat completion request, context) tuples and is only called when
+# no earlier batch for this stage is still outstanding; otherwise that batch is
+# resumed. `apply_results` receives (custom_id, response text, context) for every
+# successful request; the batch is only forgotten once it returns.
+def run_batch(stage, build_items, apply_results, client=None):
+    client = client or openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    state = load_batch_state(stage)
+    if state:
+        print(f"🔁 Resuming batch {state['batch_id']} for {stage}")
+    else:
+        items = build_items()
+        if not items:
+            print(f"ℹ️ Nothing to submit for {stage}")
+            return
+        state = submit_batch(client, stage, items)
+
+    batch = wait_for_batch(client, state["batch_id"])
+    results = read_batch_results(client, batch) if batch.status == "completed" else {}
+    if batch.status != "completed":
+        print(f"⚠️ Batch {batch.id} ended as {batch.status}; its articles will be resubmitted next run")
+    if results:
+        apply_results([(custom_id, text, state["context"].get(custom_id)) for custom_id, text in results.items()])
+    os.remove(batch_state_path(stage))
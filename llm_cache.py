@@ -0,0 +1,58 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+
+# Case and whitespace differences between syndicated copies of a story
+# shouldn't produce different cache keys
+def normalize_content(text):
+    return " ".join(text.lower().split())
+
+def cache_key(content, model, prompt_version):
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, normalize_content(content)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# Persistent LLM response cache with least-recently-used eviction once it holds
+# more than `max_entries` responses. Safe to share between threads.
+class LLMCache:
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+    def get(self, content, model, prompt_version):
+        key = cache_key(content, model, prompt_version)
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return row[0]
+
+    def put(self, content, model, prompt_version, response):
+        key = cache_key(content, model, prompt_version)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
@@ -0,0 +1,132 @@
+import os
+import re
+import random
+import asyncio
+import openai
+
+# Upper bound on concurrent OpenAI requests; the dispatcher adapts below it
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1"))
+LLM_MAX_BACKOFF_SECONDS = 60
+
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+# OpenAI reports reset windows like "1s", "6m0s" or "250ms"
+def parse_reset_seconds(value):
+    if not value:
+        return None
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds or None
+
+def backoff_delay(attempt):
+    # Full jitter so retries from concurrent requests don't arrive in lockstep
+    return random.uniform(0, min(LLM_MAX_BACKOFF_SECONDS, LLM_BACKOFF_SECONDS * 2 ** attempt))
+
+# Sends chat completions concurrently under an AIMD window: every success widens
+# the window by roughly one request per round trip, every 429 halves it and
+# pauses sends for the server's Retry-After. The remaining-requests header
+# shrinks the window before a 429 happens.
+class LLMDispatcher:
+    def __init__(self, client=None, max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES):
+        self.client = client or openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.window = float(max(1, max_concurrency // 2))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease_at = 0.0
+        self.condition = asyncio.Condition()
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self.condition:
+            while True:
+                pause = self.paused_until - loop.time()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.window):
+                    self.in_flight += 1
+                    return
+                else:
+                    await self.condition.wait()
+
+    async def _release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _pause(self, seconds):
+        if seconds:
+            loop = asyncio.get_running_loop()
+            self.paused_until = max(self.paused_until, loop.time() + seconds)
+
+    def _on_success(self, headers):
+        self.window = min(self.max_concurrency, self.window + 1 / self.window)
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.isdigit() and int(remaining) < self.window:
+            self.window = max(1.0, float(remaining))
+            if int(remaining) == 0:
+                self._pause(parse_reset_seconds(headers.get("x-ratelimit-reset-requests")))
+
+    def _on_rate_limited(self, error, sent_at):
+        # Requests already in flight when the window was last cut report the
+        # same congestion; only halve once per round of sends
+        if sent_at > self.last_decrease_at:
+            self.window = max(1.0, self.window / 2)
+            self.last_decrease_at = asyncio.get_running_loop().time()
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            self._pause(float(retry_after))
+        except (TypeError, ValueError):
+            self._pause(parse_reset_seconds(error.response.headers.get("x-ratelimit-reset-requests")))
+
+    # Returns the completion's message text, or None once retries are exhausted
+    async def complete(self, **request):
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            sent_at = asyncio.get_running_loop().time()
+            try:
+                raw = await self.client.chat.completions.with_raw_response.create(**request)
+                self._on_success(raw.headers)
+                return raw.parse().choices[0].message.content
+            except openai.RateLimitError as e:
+                self._on_rate_limited(e, sent_at)
+                print(f"🐢 Rate limited, window now {int(self.window)} (attempt {attempt + 1})")
+            except TRANSIENT_ERRORS as e:
+                print(f"⚠️ Transient OpenAI error (attempt {attempt + 1}): {e}")
+            except Exception as e:
+                print(f"❌ OpenAI error: {e}")
+                return None
+            finally:
+                await self._release()
+            await asyncio.sleep(backoff_delay(attempt))
+        print(f"❌ OpenAI request failed after {self.max_retries + 1} attempts")
+        return None
+
+# Run `worker` over rows from a (blocking) iterable with at most `max_pending`
+# rows in flight, pulling the next row only when there is room for it.
+async def process_rows(rows, worker, max_pending):
+    rows = iter(rows)
+    pending = set()
+
+    async def guarded(row):
+        try:
+            await worker(row)
+        except Exception as e:
+            print(f"❌ Failed to process row {row.get('id')}: {e}")
+
+    while True:
+        row = await asyncio.to_thread(next, rows, None)
+        if row is None:
+            break
+        pending.add(asyncio.create_task(guarded(row)))
+        if len(pending) >= max_pending:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if pending:
+        await asyncio.wait(pending)
@@ -0,0 +1,12 @@
+-- Near-duplicate marking (near_duplicates.py). The scrape, analyze and enrich
+-- work queries all filter on canonical_article_id is null, so run this before
+-- deploying that code; without the column every stage fetches nothing.
+alter table news.articles
+    add column if not exists canonical_article_id uuid
+    references news.articles (id) on delete set null;
+
+-- Copies of an article are found through this column when the article is
+-- deleted (on delete set null); originals, the vast majority, stay out of it
+create index if not exists articles_canonical_article_id_idx
+    on news.articles (canonical_article_id)
+    where canonical_article_id is not null;
@@ -0,0 +1,213 @@
+import os
+import re
+import zlib
+import threading
+from functools import lru_cache
+import numpy as np
+from supabase_rest import bulk_upsert, existing_ids
+
+# Syndicated copies of a story arrive under different URLs (GNews, several RSS
+# sections, NPR). Each article gets a MinHash signature over its word shingles;
+# an LSH index over the signatures finds earlier articles that are probably
+# near-identical, and a match above NEAR_DUP_THRESHOLD marks the new article
+# with canonical_article_id so scraping, analysis and enrichment skip it. The
+# column comes from migrations/add_canonical_article_id.sql.
+
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+# Entries kept per index; the oldest are forgotten first
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "20000"))
+# Title + description signatures at ingest, full_content signatures after scraping
+INGEST_INDEX_PATH = os.getenv("NEAR_DUP_INGEST_INDEX", "near_dup_ingest.npz")
+CONTENT_INDEX_PATH = os.getenv("NEAR_DUP_CONTENT_INDEX", "near_dup_content.npz")
+
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows make pairs above ~0.7 Jaccard likely to share a bucket
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 3
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed seed: signatures are persisted, so the permutations must never change
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash(text):
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(text)], dtype=np.uint64)
+    if not len(hashes):
+        return None
+    permuted = ((np.outer(hashes, _PERM_A) % MERSENNE_PRIME + _PERM_B) % MERSENNE_PRIME) & MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+def similarity(a, b):
+    return float(np.mean(a == b))
+
+def article_text(article):
+    return f"{article.get('title') or ''} {article.get('description') or ''}"
+
+# LSH index of article signatures, persisted to an .npz file. Safe to share
+# between threads.
+class NearDuplicateIndex:
+    def __init__(self, path, threshold=NEAR_DUP_THRESHOLD, max_entries=NEAR_DUP_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.signatures = {}
+        self.buckets = {}
+        if path and os.path.exists(path):
+            data = np.load(path)
+            for key, signature in zip(data["ids"].tolist(), data["signatures"]):
+                self._add(key, signature)
+
+    def _bands(self, signature):
+        return [(band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()) for band in range(LSH_BANDS)]
+
+    def _add(self, key, signature):
+        self.signatures[key] = signature
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, set()).add(key)
+
+    def _remove(self, key):
+        signature = self.signatures.pop(key)
+        for band in self._bands(signature):
+            bucket = self.buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band]
+
+    # Most similar indexed key at or above the threshold, or None. `exclude`
+    # is the caller's own key, which must never count as its own duplicate.
+    def find(self, signature, exclude=None):
+        if signature is None:
+            return None
+        with self.lock:
+            candidates = set()
+            for band in self._bands(signature):
+                candidates |= self.buckets.get(band, set())
+            candidates.discard(exclude)
+            best, best_score = None, self.threshold
+            for key in candidates:
+                score = similarity(signature, self.signatures[key])
+                if score >= best_score:
+                    best, best_score = key, score
+            return best
+
+    def add(self, key, signature):
+        if signature is None:
+            return
+        with self.lock:
+            if key in self.signatures:
+                self._remove(key)
+            self._add(key, signature)
+            # Dicts keep insertion order, so the first keys are the oldest
+            while len(self.signatures) > self.max_entries:
+                self._remove(next(iter(self.signatures)))
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.signatures:
+                self._remove(key)
+
+    def save(self):
+        with self.lock:
+            keys = list(self.signatures)
+            signatures = np.array([self.signatures[k] for k in keys], dtype=np.uint32).reshape(-1, NUM_PERMUTATIONS)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, ids=np.array(keys, dtype=str), signatures=signatures)
+            os.replace(tmp_path, self.path)
+
+@lru_cache(maxsize=None)
+def get_index(path):
+    return NearDuplicateIndex(path)
+
+# find() limited to articles that still exist. Indexed ids are read back from
+# disk and an article may have been deleted since; canonical_article_id is a
+# foreign key, so pointing at one would get the whole write rejected. Stale
+# ids are dropped from the index and the lookup is repeated. Ids in `verified`
+# are known to exist already.
+def find_existing(index, signature, exclude=None, verified=frozenset()):
+    while True:
+        match = index.find(signature, exclude)
+        if match is None or match in verified:
+            return match
+        found = existing_ids("articles", [match])
+        if found is None or match in found:
+            return match
+        print(f"🧹 Article {match} no longer exists, dropping it from the near-duplicate index")
+        index.discard(match)
+
+# Drop every id in `ids` that no longer exists from `index` with one lookup,
+# and return the ones that do exist
+def drop_deleted(index, ids):
+    ids = {i for i in ids if i is not None}
+    found = existing_ids("articles", ids) if ids else None
+    if found is None:
+        return set()
+    for article_id in ids - found:
+        print(f"🧹 Article {article_id} no longer exists, dropping it from the near-duplicate index")
+        index.discard(article_id)
+    return found
+
+# Insert ingested articles, marking near-duplicates of earlier articles (or of
+# another article in the same batch) with canonical_article_id. Originals go in
+# first so the duplicates within the batch can point at their new ids. The
+# index is only written by save_ingest_index(), once per run. `on_inserted`, if
+# given, is called with the {"id", "url"} of every newly inserted original.
+def insert_articles_deduplicated(rows, on_inserted=None):
+    index = get_index(INGEST_INDEX_PATH)
+    batch_index = NearDuplicateIndex(None)
+    originals, later = [], []
+    signatures = {}
+    signed = [(row, minhash(article_text(row))) for row in rows]
+    # Check every match from earlier runs with one request up front; the rare
+    # second-best match after a drop is checked on its own
+    verified = drop_deleted(index, [index.find(signature, row.get("id")) for row, signature in signed])
+    for row, signature in signed:
+        # Ingested rows normally have no id yet, and one whose URL is already
+        # stored is ignored by the upsert, but a row that does carry its id
+        # still never matches itself
+        row = {**row, "canonical_article_id": find_existing(index, signature, row.get("id"), verified)}
+        if row["canonical_article_id"] is None:
+            batch_match = batch_index.find(signature)
+            # The same URL twice in a batch is left to bulk_upsert's own dedupe
+            if batch_match is not None and batch_match != row["url"]:
+                later.append((row, batch_match))
+                continue
+            batch_index.add(row["url"], signature)
+            signatures[row["url"]] = signature
+        originals.append(row)
+
+    counts = bulk_upsert("articles", originals, on_conflict="url", returning="id")
+    ids_by_url = {r["url"]: r["id"] for r in counts.pop("rows")}
+    for url, article_id in ids_by_url.items():
+        if url in signatures:
+            index.add(article_id, signatures[url])
+    new_originals = [{"id": article_id, "url": url} for url, article_id in ids_by_url.items() if url in signatures]
+    if on_inserted and new_originals:
+        on_inserted(new_originals)
+
+    duplicates = [{**row, "canonical_article_id": ids_by_url.get(url)} for row, url in later]
+    if duplicates:
+        # A canonical that wasn't inserted (its URL was already stored) leaves
+        # its copies unmarked; the content check after scraping still applies
+        later_counts = bulk_upsert("articles", duplicates, on_conflict="url")
+        for key in ("inserted", "duplicates", "failed"):
+            counts[key] += later_counts[key]
+
+    counts["near_duplicates"] = sum(1 for row in originals + duplicates if row["canonical_article_id"])
+    if counts["near_duplicates"]:
+        print(f"🧬 {counts['near_duplicates']} articles marked as near-duplicates")
+    return counts
+
+def save_ingest_index():
+    get_index(INGEST_INDEX_PATH).save()
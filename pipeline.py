@@ -0,0 +1,188 @@
+import os
+import queue
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from gnews import run_gnews
+from rss_pipeline import run_rss
+from article_scrape import (
+    SCRAPE_WORKERS, SCRAPE_PARSE_WORKERS, DomainQueues,
+    fetch_unscraped_articles, is_due_for_retry, scrape_and_store
+)
+from analyze_articles import analyze_articles, fetch_articles_to_analyze
+from enrich_articles import enrich_articles, fetch_summaries_to_enrich
+from near_duplicates import CONTENT_INDEX_PATH, get_index
+from llm_dispatch import LLM_MAX_CONCURRENCY
+
+load_dotenv()
+
+# Runs ingest -> scrape -> analyze -> enrich in one process. Each stage hands
+# its output to the next through a bounded queue, so a new article is scraped
+# as soon as it is inserted and summarized as soon as it is scraped, and a slow
+# stage holds back the ones before it instead of piling up work in memory.
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+PIPELINE_SCRAPE_WORKERS = int(os.getenv("PIPELINE_SCRAPE_WORKERS", str(SCRAPE_WORKERS)))
+PIPELINE_ANALYZE_CONCURRENCY = int(os.getenv("PIPELINE_ANALYZE_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+PIPELINE_ENRICH_CONCURRENCY = int(os.getenv("PIPELINE_ENRICH_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+
+DONE = None
+
+def drain(stage_queue):
+    while True:
+        item = stage_queue.get()
+        if item is DONE:
+            return
+        yield item
+
+def put_all(stage_queue, items):
+    for item in items:
+        stage_queue.put(item)
+
+# Ids a stage has already taken, from the backlog or from the stage before it.
+# The backlog is walked while the stages run, so it can reach an article this
+# run has just inserted, scraped or summarized; whichever path gets to an id
+# first processes it and the other skips it.
+class Claims:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = set()
+
+    def take(self, items):
+        for item in items:
+            with self.lock:
+                if item["id"] in self.ids:
+                    continue
+                self.ids.add(item["id"])
+            yield item
+
+# Work left over from earlier runs, streamed a page at a time while the stages
+# run. Claims keeps rows this run produces from being handled twice.
+def load_backlog():
+    now = datetime.now(timezone.utc)
+    scrape = (a for a in fetch_unscraped_articles() if is_due_for_retry(a, now))
+    analyze = fetch_articles_to_analyze()
+    enrich = (a for a in fetch_summaries_to_enrich() if a.get("summary"))
+    return scrape, analyze, enrich
+
+def ingest_stage(scrape_queue, skip_ingest):
+    def on_inserted(articles):
+        put_all(scrape_queue, articles)
+
+    if skip_ingest:
+        return
+    for name, run in (("RSS", run_rss), ("GNews", run_gnews)):
+        try:
+            run(on_inserted=on_inserted)
+        except Exception as e:
+            print(f"❌ {name} ingest failed: {e}")
+
+def scrape_stage(scrape_queue, analyze_queue):
+    domains = DomainQueues()
+    claims = Claims()
+
+    # Sort incoming articles by publisher so workers only pick up ones whose
+    # publisher is free. Only ids and URLs are held, so these queues are unbounded.
+    def feed():
+        try:
+            for article in claims.take(drain(scrape_queue)):
+                domains.put(article)
+        finally:
+            domains.close()
+
+    def worker(parse_pool):
+        while True:
+            article = domains.get()
+            if article is None:
+                return
+            try:
+                content = scrape_and_store(article, parse_pool, domains)
+            except Exception as e:
+                print(f"❌ Failed to scrape {article.get('url')}: {e}")
+                continue
+            if content:
+                analyze_queue.put({"id": article["id"], "url": article["url"], "full_content": content})
+
+    # Parse processes are spawned rather than forked: the other stages' threads
+    # are already running and a fork could copy one of their held locks
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=SCRAPE_PARSE_WORKERS, mp_context=spawn) as parse_pool:
+        workers = [threading.Thread(target=worker, args=(parse_pool,)) for _ in range(PIPELINE_SCRAPE_WORKERS)]
+        workers.append(threading.Thread(target=feed))
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    get_index(CONTENT_INDEX_PATH).save()
+
+def analyze_stage(analyze_queue, enrich_queue, fused):
+    def on_analyzed(article, data):
+        if not fused:
+            enrich_queue.put({"id": article["id"], "url": article["url"], "summary": data["summary"]})
+
+    asyncio.run(analyze_articles(Claims().take(drain(analyze_queue)), fused=fused, on_analyzed=on_analyzed,
+                                 max_concurrency=PIPELINE_ANALYZE_CONCURRENCY))
+
+def enrich_stage(enrich_queue):
+    asyncio.run(enrich_articles(Claims().take(drain(enrich_queue)), max_concurrency=PIPELINE_ENRICH_CONCURRENCY))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ingest, scraping, analysis and enrichment as one streaming pipeline")
+    parser.add_argument("--fused", action="store_true", help="summarize and enrich in one call (no separate enrichment stage)")
+    parser.add_argument("--skip-ingest", action="store_true", help="only work through the existing backlog")
+    args = parser.parse_args()
+
+    scrape_backlog, analyze_backlog, enrich_backlog = load_backlog()
+    scrape_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    analyze_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    enrich_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    # A stage that fails keeps emptying its input so the stages before it can
+    # still finish
+    def run_stage(name, stage, input_queue=None):
+        try:
+            stage()
+        except Exception as e:
+            print(f"❌ {name} stage failed: {e}")
+            if input_queue is not None:
+                for _ in drain(input_queue):
+                    pass
+
+    def start(name, target, *args):
+        thread = threading.Thread(target=run_stage, args=(name, target, *args), name=name)
+        thread.start()
+        return thread
+
+    # Every queue has two producers, the stage before it and a feeder for the
+    # old backlog, so new articles are interleaved with old ones instead of
+    # waiting behind them
+    producers = [
+        (scrape_queue, [
+            start("ingest", lambda: ingest_stage(scrape_queue, args.skip_ingest)),
+            start("scrape backlog", lambda: put_all(scrape_queue, scrape_backlog)),
+        ]),
+        (analyze_queue, [
+            start("scrape", lambda: scrape_stage(scrape_queue, analyze_queue), scrape_queue),
+            start("analyze backlog", lambda: put_all(analyze_queue, analyze_backlog)),
+        ]),
+        (enrich_queue, [
+            start("analyze", lambda: analyze_stage(analyze_queue, enrich_queue, args.fused), analyze_queue),
+            start("enrich backlog", lambda: put_all(enrich_queue, enrich_backlog)),
+        ]),
+    ]
+    enrich = start("enrich", lambda: enrich_stage(enrich_queue), enrich_queue)
+
+    # A queue is closed once both of its producers are done
+    for stage_queue, threads in producers:
+        for thread in threads:
+            thread.join()
+        stage_queue.put(DONE)
+    enrich.join()
+    print("🏁 Pipeline finished")
+
+if __name__ == "__main__":
+    main()
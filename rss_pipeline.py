@@ -1,8 +1,13 @@
 import os
+import json
 import requests
 import feedparser
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from near_duplicates import insert_articles_deduplicated, save_ingest_index
+from seen_urls import canonicalize_url, drop_seen, mark_seen, save_seen_urls
+from keyword_matcher import KeywordMatcher
 
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -22,6 +27,12 @@ RSS_FEEDS = [
     "https://www.govexec.com/rss/pay-benefits/"
 ]
 
+# Per-feed ETag/Last-Modified and the entry GUIDs seen on the last fetch
+RSS_STATE_FILE = os.getenv("RSS_STATE_FILE", "rss_feed_state.json")
+RSS_FETCH_WORKERS = int(os.getenv("RSS_FETCH_WORKERS", "8"))
+# "token" matches any word of a search query, "phrase" only the whole query
+RSS_MATCH_MODE = os.getenv("RSS_MATCH_MODE", "token")
+
 HEADERS = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -41,26 +52,61 @@ def get_search_keywords():
         return []
     return [item["query"].lower() for item in response.json()]
 
-def fetch_rss_articles(keywords):
+def load_feed_state():
+    try:
+        with open(RSS_STATE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"⚠️ Failed to load feed state, fetching all feeds in full: {e}")
+        return {}
+
+def save_feed_state(feed_state):
+    tmp_path = f"{RSS_STATE_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(feed_state, f, indent=2)
+    os.replace(tmp_path, RSS_STATE_FILE)
+
+def fetch_feed(feed_url, state):
+    # feedparser sends If-None-Match / If-Modified-Since and reports 304 as feed.status
+    return feedparser.parse(feed_url, etag=state.get("etag"), modified=state.get("modified"))
+
+def entry_guid(entry):
+    return entry.get("id") or entry.get("link")
+
+def fetch_rss_articles(keywords, feed_state=None):
+    if feed_state is None:
+        feed_state = {}
     articles = []
-    tokens = set()
-    for phrase in keywords:
-        tokens.update(phrase.lower().split())
-    for feed_url in RSS_FEEDS:
-        feed = feedparser.parse(feed_url)
-        print(f"📡 {feed_url} → {len(feed.entries)} entries", end="")
+    matcher = KeywordMatcher(keywords, mode=RSS_MATCH_MODE)
+    with ThreadPoolExecutor(max_workers=RSS_FETCH_WORKERS) as pool:
+        feeds = list(pool.map(lambda url: fetch_feed(url, feed_state.get(url, {})), RSS_FEEDS))
+    for feed_url, feed in zip(RSS_FEEDS, feeds):
+        state = feed_state.get(feed_url, {})
+        if feed.get("status") == 304:
+            print(f"📡 {feed_url} → not modified")
+            continue
+        seen_guids = set(state.get("guids", []))
+        new_entries = [entry for entry in feed.entries if entry_guid(entry) not in seen_guids]
+        print(f"📡 {feed_url} → {len(feed.entries)} entries, {len(new_entries)} new", end="")
         if feed.bozo:
             print(f" ⚠️ BozoException: {feed.bozo_exception}")
         else:
             print()
-        for entry in feed.entries:
-            text = (entry.title + entry.get("summary", "")).lower()
-            matched = [token for token in tokens if token in text]
+        if feed.entries:
+            feed_state[feed_url] = {
+                "etag": feed.get("etag"),
+                "modified": feed.get("modified"),
+                "guids": [entry_guid(entry) for entry in feed.entries]
+            }
+        for entry in new_entries:
+            matched = matcher.match(f"{entry.title} {entry.get('summary', '')}")
             if matched:
                 print(f"✅ Match: {entry.title} → {matched}")
                 article = {
                     "title": entry.title,
-                    "url": entry.link,
+                    "url": canonicalize_url(entry.link),
                     "description": entry.get("summary", ""),
                     "source": feed.feed.get("title", "RSS"),
                     "published_at": entry.get("published", datetime.utcnow().isoformat()),
@@ -72,32 +118,33 @@ def fetch_rss_articles(keywords):
                 print(f"❌ No match: {entry.title}")
     return articles
 
-def insert_articles_to_supabase(articles):
-    inserted = 0
-    for article in articles:
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/articles",
-            headers=HEADERS,
-            json=article
-        )
-        if response.status_code in [200, 201]:
-            print(f"✅ Inserted: {article['title']}")
-            inserted += 1
-        elif response.status_code == 409:
-            print(f"⚠️ Duplicate: {article['title']}")
-        else:
-            print(f"❌ Failed: {article['title']} — {response.status_code} {response.text}")
-    return inserted
+def insert_articles_to_supabase(articles, on_inserted=None):
+    articles = drop_seen(articles)
+    counts = insert_articles_deduplicated(articles, on_inserted)
+    mark_seen(articles, counts)
+    return counts
 
-if __name__ == "__main__":
+# `on_inserted` receives the newly inserted original articles ({"id", "url"} rows)
+def run_rss(on_inserted=None):
     print("📥 Fetching RSS feed articles...")
     keywords = get_search_keywords()
     print(f"🗝️ Loaded {len(keywords)} search keywords")
     print(keywords)
     if not keywords:
         print("⚠️ No search keywords found. Exiting.")
+        return
+    feed_state = load_feed_state()
+    articles = fetch_rss_articles(keywords, feed_state)
+    print(f"🔎 Found {len(articles)} matching articles")
+    counts = insert_articles_to_supabase(articles, on_inserted)
+    # Only remember what was seen once it is safely written, so failed rows are retried
+    if counts["failed"]:
+        print("⚠️ Some inserts failed — feed state not saved, entries will be re-checked next run")
     else:
-        articles = fetch_rss_articles(keywords)
-        print(f"🔎 Found {len(articles)} matching articles")
-        inserted = insert_articles_to_supabase(articles)
-        print(f"🚀 Finished — {inserted} new articles inserted.")
\ No newline at end of file
+        save_feed_state(feed_state)
+    save_ingest_index()
+    save_seen_urls()
+    print(f"🚀 Finished — {counts['inserted']} new articles inserted.")
+
+if __name__ == "__main__":
+    run_rss()
\ No newline at end of file
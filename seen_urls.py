@@ -0,0 +1,93 @@
+import os
+import hashlib
+import threading
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import numpy as np
+from supabase_rest import iter_rows
+
+SEEN_URLS_PATH = os.getenv("SEEN_URLS_PATH", "seen_urls.npy")
+
+# Query parameters that only say where a click came from
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "ocid", "cmpid", "cmp",
+    "ref", "ref_src", "referrer", "rss", "from", "source", "src", "feed", "feedname",
+    "partner", "smid", "taid", "ito", "_ga", "_hsenc", "_hsmi", "mkt_tok"
+}
+
+# Same article, same string: lowercase scheme and host, no default port,
+# fragment, trailing slash or tracking parameters, remaining parameters sorted
+def canonicalize_url(url):
+    if not url:
+        return url
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/")
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+# "www." is only ignored for matching; the stored URL keeps it since some
+# publishers don't serve the bare domain
+def url_hash(url):
+    canonical = canonicalize_url(url).replace("://www.", "://", 1)
+    return int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "little")
+
+# Every article URL already stored, kept as 64-bit hashes of the canonical URL
+# in a sorted .npy file (8 bytes per article, and unlike a Bloom filter it never
+# drops a new article as a false positive). A missing file is rebuilt from the
+# articles table.
+class SeenUrls:
+    def __init__(self, path=SEEN_URLS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self.hashes = set(np.load(path).tolist())
+        else:
+            print("🧱 No seen-URL file, rebuilding it from Supabase...")
+            self.hashes = {url_hash(row["url"]) for row in iter_rows("articles", "id,url") if row.get("url")}
+            print(f"🧱 Loaded {len(self.hashes)} known article URLs")
+            self.save()
+
+    def __contains__(self, url):
+        return url_hash(url) in self.hashes
+
+    def add(self, urls):
+        with self.lock:
+            self.hashes.update(url_hash(url) for url in urls if url)
+
+    def save(self):
+        with self.lock:
+            hashes = np.array(sorted(self.hashes), dtype=np.uint64)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, hashes)
+        os.replace(tmp_path, self.path)
+
+@lru_cache(maxsize=None)
+def get_seen_urls():
+    return SeenUrls()
+
+# Rows whose URL hasn't been stored before; known articles never reach Supabase
+def drop_seen(rows):
+    seen = get_seen_urls()
+    unseen = [row for row in rows if row.get("url") and row["url"] not in seen]
+    if len(unseen) < len(rows):
+        print(f"⏭️ Skipping {len(rows) - len(unseen)} already-seen articles")
+    return unseen
+
+# Remember rows once the insert went through; after a failed chunk nothing is
+# recorded so those rows are sent again next run
+def mark_seen(rows, counts):
+    if not counts["failed"]:
+        get_seen_urls().add(row["url"] for row in rows)
+
+def save_seen_urls():
+    get_seen_urls().save()
@@ -0,0 +1,200 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# Rows per PostgREST array-body request
+BULK_CHUNK_SIZE = int(os.getenv("SUPABASE_BULK_CHUNK_SIZE", "500"))
+# Rows per keyset page when walking a work queue
+PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "500"))
+POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "10"))
+REQUEST_TIMEOUT = 30
+
+_session = None
+
+def get_session():
+    # One pooled session per process so every request reuses the same TCP/TLS connections
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session.headers.update({
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
+        })
+    return _session
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+# Walk `table` in id order, yielding rows lazily one page at a time. Each page
+# asks for ids after the last one seen, so rows that drop out of the filter while
+# they are being processed never shift later pages, and stopping only on an
+# empty page means a server-side row cap can't truncate the walk.
+def iter_rows(table, select, filters=None, page_size=PAGE_SIZE):
+    session = get_session()
+    url = f"{SUPABASE_URL}/rest/v1/{table}"
+    last_id = None
+    while True:
+        params = dict(filters or {})
+        params.update({"select": select, "order": "id.asc", "limit": page_size})
+        if last_id is not None:
+            params["id"] = f"gt.{last_id}"
+        try:
+            response = session.get(url, params=params, headers={"Accept-Profile": "news"}, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"❌ Failed to fetch {table} after id {last_id}: {e}")
+            return
+        if response.status_code != 200:
+            print(f"❌ Failed to fetch {table} after id {last_id}: {response.status_code} {response.text}")
+            return
+        rows = response.json()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1]["id"]
+
+# The subset of `ids` that exist in `table`, or None if the lookup failed
+def existing_ids(table, ids, chunk_size=200):
+    found = set()
+    for chunk in chunked(sorted(ids), chunk_size):
+        params = {"select": "id", "id": f"in.({','.join(str(i) for i in chunk)})"}
+        try:
+            response = get_session().get(f"{SUPABASE_URL}/rest/v1/{table}", params=params,
+                                         headers={"Accept-Profile": "news"}, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"❌ Failed to look up {table} ids: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"❌ Failed to look up {table} ids: {response.status_code} {response.text}")
+            return None
+        found.update(row["id"] for row in response.json())
+    return found
+
+# Insert rows in chunks, skipping rows that conflict on `on_conflict`.
+# Each chunk is one POST; PostgREST returns only the rows it actually inserted,
+# so duplicates are the difference. With merge=True conflicting rows are
+# updated instead and every row in a successful chunk counts as inserted.
+# `returning` names extra columns to hand back for the inserted rows, under
+# counts["rows"].
+def bulk_upsert(table, rows, on_conflict="url", chunk_size=BULK_CHUNK_SIZE, merge=False, returning=None):
+    counts = {"inserted": 0, "duplicates": 0, "failed": 0}
+    if returning:
+        counts["rows"] = []
+    if not rows:
+        return counts
+
+    # Collapse repeats within the batch; the first occurrence wins
+    unique_rows = {}
+    for row in rows:
+        key = row.get(on_conflict)
+        if key in unique_rows:
+            counts["duplicates"] += 1
+        else:
+            unique_rows[key] = row
+    rows = list(unique_rows.values())
+
+    session = get_session()
+    url = f"{SUPABASE_URL}/rest/v1/{table}"
+    resolution = "merge-duplicates" if merge else "ignore-duplicates"
+    headers = {
+        "Content-Type": "application/json",
+        "Prefer": f"resolution={resolution},return=representation",
+        "Content-Profile": "news",
+        "Accept-Profile": "news"
+    }
+    for chunk in chunked(rows, chunk_size):
+        try:
+            response = session.post(
+                url,
+                params={"on_conflict": on_conflict, "select": f"{on_conflict},{returning}" if returning else on_conflict},
+                headers=headers,
+                json=chunk,
+                timeout=REQUEST_TIMEOUT
+            )
+        except requests.RequestException as e:
+            print(f"❌ Bulk upsert of {len(chunk)} rows into {table} failed: {e}")
+            counts["failed"] += len(chunk)
+            continue
+
+        if response.status_code in [200, 201]:
+            inserted_rows = response.json()
+            inserted = len(inserted_rows)
+            if returning:
+                counts["rows"].extend(inserted_rows)
+            counts["inserted"] += inserted
+            counts["duplicates"] += len(chunk) - inserted
+        else:
+            print(f"❌ Bulk upsert of {len(chunk)} rows into {table} failed: {response.status_code} {response.text}")
+            counts["failed"] += len(chunk)
+
+    print(f"📦 {table}: {counts['inserted']} inserted, {counts['duplicates']} duplicates, {counts['failed']} failed")
+    return counts
+
+# Apply per-row updates (each row carries its own `key` value) as PATCHes fanned
+# out over the pooled session. Returns updated / failed counts.
+def patch_rows(table, rows, key="id", workers=POOL_SIZE):
+    session = get_session()
+    headers = {
+        "Content-Type": "application/json",
+        "Prefer": "return=minimal",
+        "Content-Profile": "news"
+    }
+
+    def patch(row):
+        data = {k: v for k, v in row.items() if k != key}
+        url = f"{SUPABASE_URL}/rest/v1/{table}?{key}=eq.{row[key]}"
+        try:
+            response = session.patch(url, headers=headers, json=data, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"⚠️ Failed to update {table} {row[key]}: {e}")
+            return False
+        if response.status_code not in [200, 204]:
+            print(f"⚠️ Failed to update {table} {row[key]}: {response.status_code} {response.text}")
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(patch, rows))
+    counts = {"updated": sum(results), "failed": len(results) - sum(results)}
+    print(f"📝 {table}: {counts['updated']} updated, {counts['failed']} failed")
+    return counts
+
+# Collects row updates from any thread and writes them with patch_rows every
+# `flush_size` rows; call flush() once at the end for the remainder. Updates are
+# PATCHes rather than a merge upsert, so a row deleted in the meantime is never
+# re-created and only UPDATE rights are needed.
+class BufferedUpdater:
+    def __init__(self, table, flush_size=BULK_CHUNK_SIZE, key="id"):
+        self.table = table
+        self.flush_size = flush_size
+        self.key = key
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def add(self, row):
+        with self.lock:
+            self.rows.append(row)
+            if len(self.rows) < self.flush_size:
+                return
+            rows, self.rows = self.rows, []
+        self._write(rows)
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            self._write(rows)
+
+    def _write(self, rows):
+        patch_rows(self.table, rows, key=self.key)
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+import llm_batch
+
+
+# Just enough of the OpenAI Files and Batch endpoints for run_batch. A batch
+# completes on its second poll and answers every request with "echo: <prompt>";
+# `fail_polls` makes that many polls answer 500 first.
+class BatchEndpoint(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    files = {}
+    batches = {}
+    fail_polls = 0
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, data, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        done = batch["polls"] >= 2
+        total = len(self.files[batch["input_file_id"]])
+        output_file_id = None
+        if done:
+            output_file_id = f"file-out-{batch_id}"
+            self.files[output_file_id] = [
+                {
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": {
+                        "choices": [{"message": {"content": "echo: " + request["body"]["messages"][-1]["content"]}}]
+                    }},
+                }
+                for request in self.files[batch["input_file_id"]]
+            ]
+        self.send_body(200, json.dumps({
+            "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions",
+            "input_file_id": batch["input_file_id"], "completion_window": "24h", "created_at": 0,
+            "status": "completed" if done else "in_progress", "output_file_id": output_file_id,
+            "request_counts": {"total": total, "completed": total if done else 0, "failed": 0},
+        }).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            # The JSONL lines sit unchanged inside the multipart body
+            lines = [json.loads(line) for line in body.decode().splitlines() if line.startswith('{"custom_id"')]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = lines
+            self.send_body(200, json.dumps({
+                "id": file_id, "object": "file", "bytes": len(body), "created_at": 0,
+                "filename": "batch.jsonl", "purpose": "batch", "status": "processed",
+            }).encode())
+        else:
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {"input_file_id": json.loads(body)["input_file_id"], "polls": 0}
+            self.send_batch(batch_id)
+
+    def do_GET(self):
+        if self.path.endswith("/content"):
+            file_id = self.path.split("/")[3]
+            lines = "\n".join(json.dumps(line) for line in self.files[file_id])
+            self.send_body(200, lines.encode(), "application/jsonl")
+            return
+        batch_id = self.path.rsplit("/", 1)[1]
+        self.batches[batch_id]["polls"] += 1
+        if BatchEndpoint.fail_polls:
+            BatchEndpoint.fail_polls -= 1
+            self.send_body(500, b'{"error": {"message": "server error"}}')
+            return
+        self.send_batch(batch_id)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    BatchEndpoint.files = {}
+    BatchEndpoint.batches = {}
+    BatchEndpoint.fail_polls = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BatchEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_batch, "BATCH_POLL_SECONDS", 0)
+    yield openai.OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    server.shutdown()
+    server.server_close()
+
+
+def items():
+    return [
+        (article_id, {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": f"summarize {article_id}"}]}, {"url": f"u{article_id}"})
+        for article_id in ("a1", "a2")
+    ]
+
+
+def test_run_batch_applies_results_with_their_context(client):
+    applied = []
+
+    llm_batch.run_batch("analyze", items, applied.extend, client=client)
+
+    assert sorted(applied) == [
+        ("a1", "echo: summarize a1", {"url": "ua1"}),
+        ("a2", "echo: summarize a2", {"url": "ua2"}),
+    ]
+    assert len(BatchEndpoint.batches) == 1
+    assert not os.path.exists(llm_batch.batch_state_path("analyze"))
+
+
+def test_run_batch_resumes_the_submitted_batch_after_a_crash(client):
+    BatchEndpoint.fail_polls = 1
+    with pytest.raises(openai.APIError):
+        llm_batch.run_batch("analyze", items, pytest.fail, client=client)
+    assert llm_batch.load_batch_state("analyze")["batch_id"] == "batch-0"
+
+    applied = []
+    llm_batch.run_batch("analyze", pytest.fail, applied.extend, client=client)
+
+    # The restart polled the same batch rather than building and paying for a new one
+    assert len(BatchEndpoint.batches) == 1
+    assert sorted(custom_id for custom_id, _, _ in applied) == ["a1", "a2"]
+    assert applied[0][2] == {"url": f"u{applied[0][0]}"}
+    assert not os.path.exists(llm_batch.batch_state_path("analyze"))
+
+
+def test_run_batch_submits_nothing_without_items(client):
+    llm_batch.run_batch("enrich", list, pytest.fail, client=client)
+
+    assert BatchEndpoint.batches == {}
+    assert not os.path.exists(llm_batch.batch_state_path("enrich"))
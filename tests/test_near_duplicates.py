@@ -0,0 +1,33 @@
+import near_duplicates
+from near_duplicates import NearDuplicateIndex, find_existing, minhash
+
+STORY = "The agency said the budget request for next year adds funding for shipbuilding and cuts two programs. " * 5
+
+
+def test_find_never_returns_the_excluded_key():
+    index = NearDuplicateIndex(None)
+    signature = minhash(STORY)
+    index.add("article-1", signature)
+
+    assert index.find(signature) == "article-1"
+    assert index.find(signature, exclude="article-1") is None
+
+
+def test_find_existing_drops_deleted_articles_from_the_index(monkeypatch):
+    lookups = []
+
+    def existing_ids(table, ids):
+        lookups.append(set(ids))
+        return set(ids) - {"deleted"}
+
+    monkeypatch.setattr(near_duplicates, "existing_ids", existing_ids)
+    index = NearDuplicateIndex(None)
+    signature = minhash(STORY)
+    index.add("deleted", signature)
+    index.add("kept", minhash(STORY + " Officials declined to comment."))
+
+    assert find_existing(index, signature) == "kept"
+    assert "deleted" not in index.signatures
+    assert lookups == [{"deleted"}, {"kept"}]
+    assert find_existing(index, signature, verified={"kept"}) == "kept"
+    assert len(lookups) == 2
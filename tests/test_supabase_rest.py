@@ -0,0 +1,149 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+import supabase_rest
+
+
+# Just enough of PostgREST for bulk_upsert and patch_rows: array-body POSTs
+# that skip rows conflicting on `on_conflict` and return the inserted ones, and
+# PATCHes filtered on one column
+class PostgrestStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    tables = {}
+    posts = []
+    patches = []
+    fail_chunk = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        rows = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.posts.append((url.path, query, self.headers["Prefer"], rows))
+        if self.fail_chunk == len(self.posts):
+            self.send_json(500, {"message": "boom"})
+            return
+
+        key = query["on_conflict"][0]
+        table = self.tables.setdefault(url.path, {})
+        inserted = []
+        for row in rows:
+            if row[key] in table:
+                continue
+            row = {"id": f"id-{len(table)}", **row}
+            table[row[key]] = row
+            inserted.append(row)
+        columns = query["select"][0].split(",")
+        self.send_json(201, [{c: row[c] for c in columns} for row in inserted])
+
+    def do_PATCH(self):
+        url = urlparse(self.path)
+        ((column, [condition]),) = parse_qs(url.query).items()
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.patches.append((url.path, column, condition, data))
+        table = self.tables.setdefault(url.path, {})
+        for row in table.values():
+            if f"eq.{row[column]}" == condition:
+                row.update(data)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def postgrest(monkeypatch):
+    PostgrestStandIn.tables = {}
+    PostgrestStandIn.posts = []
+    PostgrestStandIn.patches = []
+    PostgrestStandIn.fail_chunk = None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PostgrestStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(supabase_rest, "SUPABASE_URL", f"http://127.0.0.1:{server.server_port}")
+    yield PostgrestStandIn
+    server.shutdown()
+    server.server_close()
+
+
+def articles(start, stop):
+    return [{"url": f"https://example.com/{i}", "title": f"Story {i}"} for i in range(start, stop)]
+
+
+def test_bulk_upsert_sends_one_post_per_chunk(postgrest):
+    counts = supabase_rest.bulk_upsert("articles", articles(0, 1200), chunk_size=500)
+
+    assert counts == {"inserted": 1200, "duplicates": 0, "failed": 0}
+    assert [len(rows) for _, _, _, rows in postgrest.posts] == [500, 500, 200]
+    path, query, prefer, _ = postgrest.posts[0]
+    assert path == "/rest/v1/articles"
+    assert query["on_conflict"] == ["url"]
+    assert prefer == "resolution=ignore-duplicates,return=representation"
+
+
+def test_bulk_upsert_counts_stored_and_repeated_rows_as_duplicates(postgrest):
+    supabase_rest.bulk_upsert("articles", articles(0, 3))
+    postgrest.posts.clear()
+
+    rows = articles(2, 6) + articles(5, 6)
+    counts = supabase_rest.bulk_upsert("articles", rows, chunk_size=2)
+
+    # Rows 2 (already stored) and the second row 5 (repeated in the batch)
+    assert counts == {"inserted": 3, "duplicates": 2, "failed": 0}
+    assert [len(rows) for _, _, _, rows in postgrest.posts] == [2, 2]
+
+
+def test_bulk_upsert_counts_a_rejected_chunk_as_failed(postgrest):
+    postgrest.fail_chunk = 2
+
+    counts = supabase_rest.bulk_upsert("articles", articles(0, 5), chunk_size=2)
+
+    assert counts == {"inserted": 3, "duplicates": 0, "failed": 2}
+    assert len(postgrest.posts) == 3
+
+
+def test_bulk_upsert_returns_requested_columns_of_inserted_rows(postgrest):
+    supabase_rest.bulk_upsert("articles", articles(0, 1))
+
+    counts = supabase_rest.bulk_upsert("articles", articles(0, 3), returning="id")
+
+    assert counts["inserted"] == 2
+    assert counts["rows"] == [
+        {"url": "https://example.com/1", "id": "id-1"},
+        {"url": "https://example.com/2", "id": "id-2"},
+    ]
+
+
+def test_bulk_upsert_skips_the_request_for_no_rows(postgrest):
+    assert supabase_rest.bulk_upsert("articles", []) == {"inserted": 0, "duplicates": 0, "failed": 0}
+    assert postgrest.posts == []
+
+
+def test_buffered_updater_patches_rows_without_inserting(postgrest):
+    supabase_rest.bulk_upsert("articles", articles(0, 2), returning="id")
+    postgrest.posts.clear()
+
+    writer = supabase_rest.BufferedUpdater("articles", flush_size=2)
+    writer.add({"id": "id-0", "summary": "first"})
+    assert postgrest.patches == []
+    writer.add({"id": "id-1", "summary": "second"})
+    writer.add({"id": "deleted", "summary": "gone"})
+    writer.flush()
+
+    assert postgrest.posts == []
+    assert sorted(condition for _, _, condition, _ in postgrest.patches) == ["eq.deleted", "eq.id-0", "eq.id-1"]
+    rows = postgrest.tables["/rest/v1/articles"]
+    assert len(rows) == 2
+    assert [row["summary"] for row in rows.values()] == ["first", "second"]
@@ -0,0 +1,85 @@
+import re
+from functools import lru_cache
+import tiktoken
+
+# Scraped pages carry share bars, newsletter pitches and copyright footers that
+# cost tokens without saying anything; only short lines are checked so a real
+# paragraph that happens to start with "Subscribe" is kept
+BOILERPLATE_LINE = re.compile(
+    r"^(advertisement|sponsored|subscribe|sign up|share (this|on)|click here|read more|"
+    r"related:|follow us|all rights reserved|copyright|©|we use cookies|newsletter)",
+    re.IGNORECASE
+)
+BOILERPLATE_MAX_LENGTH = 120
+
+def clean_content(text):
+    paragraphs = []
+    seen = set()
+    for line in (text or "").splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if len(line) <= BOILERPLATE_MAX_LENGTH and BOILERPLATE_LINE.match(line):
+            continue
+        # Scrapers often pick up the same caption or pull quote twice
+        if line in seen:
+            continue
+        seen.add(line)
+        paragraphs.append(line)
+    return "\n\n".join(paragraphs)
+
+# Approximates ~4 characters per token when the model's BPE file can't be
+# loaded (it is downloaded on first use), so budgets still hold roughly offline
+class _CharEncoding:
+    def encode(self, text):
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"⚠️ Failed to load tokenizer for {model}, estimating tokens from characters: {e}")
+        return _CharEncoding()
+
+def count_tokens(text, model):
+    return len(get_encoding(model).encode(text))
+
+def truncate_to_tokens(text, budget, model):
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text)
+    if len(tokens) <= budget:
+        return text
+    return encoding.decode(tokens[:budget])
+
+# Pack whole paragraphs into chunks of at most `budget` tokens; a paragraph
+# longer than the budget is split on token boundaries
+def split_into_chunks(text, budget, model):
+    encoding = get_encoding(model)
+    separator_tokens = len(encoding.encode("\n\n"))
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in text.split("\n\n"):
+        tokens = encoding.encode(paragraph)
+        pieces = [paragraph] if len(tokens) <= budget else [
+            encoding.decode(tokens[i:i + budget]) for i in range(0, len(tokens), budget)
+        ]
+        for piece in pieces:
+            piece_tokens = len(tokens) if len(pieces) == 1 else len(encoding.encode(piece))
+            if current and current_tokens + separator_tokens + piece_tokens > budget:
+                chunks.append("\n\n".join(current))
+                current = []
+                current_tokens = 0
+            if current:
+                current_tokens += separator_tokens
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks